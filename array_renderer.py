@@ -0,0 +1,90 @@
+'''
+Draws a Columns board with one blit per frame, whatever the size of the board.
+
+Every cell is split into three by three regions: the middle one is the fill of the jewel and the
+eight around it are its border. The renderer keeps a palette-indexed array of these regions, one
+byte per region, and rewrites only the regions of cells that changed since the last frame. Each
+frame it scales the array up to the window through precomputed pixel maps, writes it into an
+8-bit surface whose palette colors it, and blits that surface once. The pixel maps follow the
+layout of ColumnsGame._draw_jewel, border widths and rounding included, so both renderers draw the
+same pixels; pixels no jewel covers map to an extra region of background color.
+'''
+import numpy as np
+import pygame
+import game_mechanics
+
+
+class ArrayRenderer:
+    def __init__(self, size: tuple[int, int], x_pixels: list[int], y_pixels: list[int], cell_size: tuple[int, int], border_width: int,
+                 symbol_colors: dict[str, tuple[tuple[int, ...], tuple[int, ...]]], background: tuple[int, int, int], hidden_rows: int):
+        '''
+        Creates a renderer for a surface of the given size. x_pixels and y_pixels are the left pixel of
+        every column and the top pixel of every visible row, cell_size and border_width the size of
+        a jewel and its border, and symbol_colors the border and fill colors of every cell symbol
+        '''
+        columns = len(x_pixels)
+        rows = len(y_pixels)
+        self._hidden_rows = hidden_rows
+        palette = [background[:3]]
+        border_indexes = []
+        fill_indexes = []
+        for symbol in game_mechanics.CELL_SYMBOLS:
+            border_color, fill_color = symbol_colors[symbol]
+            border_indexes.append(_palette_index(palette, border_color[:3]))
+            fill_indexes.append(_palette_index(palette, fill_color[:3]))
+        self._border_lut = np.array(border_indexes, dtype = np.uint8)
+        self._fill_lut = np.array(fill_indexes, dtype = np.uint8)
+        # The regions of every cell, plus a last column and row of regions left in the background color
+        self._regions = np.zeros((columns*3 + 1, rows*3 + 1), dtype = np.uint8)
+        self._x_map = _pixel_map(x_pixels, cell_size[0], border_width, size[0])
+        self._y_map = _pixel_map(y_pixels, cell_size[1], border_width, size[1])
+        self._scaled_columns = np.empty((size[0], rows*3 + 1), dtype = np.uint8)
+        self._pixels = np.empty(size, dtype = np.uint8)
+        self._image = pygame.Surface(size, depth = 8)
+        self._image.set_palette(palette)
+        self._drawn_board = None
+
+    def draw(self, surface: 'pygame.Surface', board: list[list[str]]) -> 'pygame.Rect':
+        'Draws the visible rows of a board over the whole surface in one blit, returning the area drawn'
+        if self._drawn_board is None:
+            self._drawn_board = [None] * len(board)
+        for col in range(len(board)):
+            if board[col] != self._drawn_board[col]:
+                self._set_column(col, board[col])
+                self._drawn_board[col] = board[col][:]
+        np.take(self._regions, self._x_map, axis = 0, out = self._scaled_columns)
+        np.take(self._scaled_columns, self._y_map, axis = 1, out = self._pixels)
+        pygame.surfarray.blit_array(self._image, self._pixels)
+        return surface.blit(self._image, (0, 0))
+
+    def _set_column(self, col: int, column: list[str]) -> None:
+        'Rewrites the regions of the visible cells of a column'
+        codes = np.frombuffer(bytes(map(game_mechanics.CELL_CODES.__getitem__, column[self._hidden_rows:])), dtype = np.uint8)
+        cells = self._regions[col*3:col*3 + 3, :-1]
+        cells[:] = np.repeat(self._border_lut[codes], 3)
+        cells[1, 1::3] = self._fill_lut[codes]
+
+
+def _palette_index(palette: list[tuple[int, ...]], color: tuple[int, ...]) -> int:
+    'Returns the index of a color in the palette, adding it if it is not there yet'
+    if color not in palette:
+        palette.append(color)
+    return palette.index(color)
+
+
+def _pixel_map(starts: list[int], cell_pixels: int, border_width: int, length: int) -> np.ndarray:
+    '''
+    Returns the region index of every pixel along one axis of the surface. A cell covers cell_pixels
+    from its start, cut short where the next cell starts, and its first and last border_width pixels
+    are border; pixels no cell covers map to the last region
+    '''
+    pixel_map = np.full(length, len(starts) * 3, dtype = np.intp)
+    offsets = np.arange(cell_pixels)
+    regions = np.where(offsets < border_width, 0, np.where(offsets >= cell_pixels - border_width, 2, 1))
+    for cell, start in enumerate(starts):
+        end = start + cell_pixels
+        if cell + 1 < len(starts):
+            end = min(end, starts[cell+1])
+        end = min(end, length)
+        pixel_map[start:end] = cell*3 + regions[:end - start]
+    return pixel_map
@@ -0,0 +1,413 @@
+'''
+Benchmarks the GameState hot paths on seeded boards of several sizes and fill levels.
+
+    python benchmark.py [--sizes 13x6,60x30,200x200,400x400] [--output results.json]
+                        [--compare baseline.json] [--threshold 0.2] [--check-targets]
+    python benchmark.py --check-startup
+
+Sizes are visible rows x columns; the two hidden rows are added on top. Every run with the same
+seed benchmarks the same boards. With --compare, the run fails (exit status 1) when any operation
+is slower than the baseline by more than the threshold fraction. With --check-targets, it fails when
+any operation on a board of TARGET_CELLS or more cells takes longer than its per-tick cost target.
+--check-startup instead times fresh interpreters importing the engine and reaching the first frame
+of a game, and fails when any of them misses its startup budget or a headless one imports pygame
+'''
+import argparse
+import json
+import platform
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import game_mechanics
+import transposition_cache
+
+_DEFAULT_SIZES = '13x6,60x30,200x200'
+_SCENARIOS = ('empty', 'half_full', 'nearly_full', 'cascade_heavy')
+_MIN_RUNS = 3
+_MAX_RUNS = 1000
+_TIME_BUDGET = 0.25
+# Per-tick cost targets in milliseconds for the landing, match and gravity paths on boards of at least
+# TARGET_CELLS cells (200x200). Landing runs every tick, while a tick that freezes a faller runs a match
+# search and then gravity, and together they have to fit in one 33ms frame at 30 frames per second
+TARGET_CELLS = 200 * 200
+TICK_TARGETS_MS = {
+    'faller_pass_time': 0.1,
+    '_should_land': 0.1,
+    'faller_move_delta': 0.1,
+    'check_if_dead': 0.1,
+    'spawn_column': 0.1,
+    'single_match': 10.0,
+    '_still_matches': 10.0,
+    'remove_match': 15.0,
+    'resolve_cascades': 33.0,
+    'shift_down_all_empties': 15.0,
+}
+# Startup budgets in milliseconds of wall time for a fresh interpreter, including the interpreter's own
+# startup. The headless ones must not import pygame; the drawn frame uses SDL's dummy video driver
+STARTUP_TARGETS_MS = {
+    'import game_mechanics': 150.0,
+    'first headless frame': 250.0,
+    'first drawn frame': 1000.0,
+}
+_STARTUP_SCRIPTS = {
+    'import game_mechanics': 'import game_mechanics',
+    'first headless frame': 'import columns_game\ncolumns_game.ColumnsGame().run_headless(max_frames = 1)',
+    'first drawn frame': (
+        'import columns_game\n'
+        'class FirstFrame(columns_game.ColumnsGame):\n'
+        '    def _draw_frame(self):\n'
+        '        super()._draw_frame()\n'
+        '        raise SystemExit\n'
+        'FirstFrame().run()'),
+}
+_HEADLESS_CHECK = "\nassert 'pygame' not in sys.modules, 'pygame was imported'"
+_STARTUP_RUNS = 5
+
+
+def generate_board(rows: int, columns: int, scenario: str, rng: random.Random) -> list[list[str]]:
+    '''
+    Returns a board of frozen jewels with two hidden rows on top. Every scenario but "cascade_heavy" holds
+    no matches; "cascade_heavy" uses three colors so most jewels are in a run and removals cascade
+    '''
+    fill = {'empty': 0, 'half_full': 0.5, 'nearly_full': 0.9, 'cascade_heavy': 0.75}[scenario]
+    colors = game_mechanics.JEWEL_COLORS[:3] if scenario == 'cascade_heavy' else game_mechanics.JEWEL_COLORS
+    board = [['   '] * (rows + 2) for col in range(columns)]
+    for col in range(columns):
+        height = min(rows, max(0, round(rows * fill + rng.uniform(-0.1, 0.1) * rows))) if fill else 0
+        for row in range(rows + 1, rows + 1 - height, -1):
+            choices = list(colors)
+            if scenario != 'cascade_heavy':
+                choices = [color for color in colors if not _completes_run(board, col, row, ' ' + color + ' ')] or choices
+            board[col][row] = ' ' + rng.choice(choices) + ' '
+    return board
+
+
+def _completes_run(board: list[list[str]], col: int, row: int, jewel: str) -> bool:
+    'Returns True if placing jewel at (col, row) makes three in a row with jewels already placed below or to the left'
+    for coldelta, rowdelta in ((0, 1), (-1, 0), (-1, 1), (-1, -1)):
+        cells = []
+        for i in (1, 2):
+            c = col + coldelta * i
+            r = row + rowdelta * i
+            cells.append(board[c][r] if 0 <= c < len(board) and 0 <= r < len(board[0]) else None)
+        if cells[0] == cells[1] == jewel:
+            return True
+    return False
+
+
+def _copy_board(board: list[list[str]]) -> list[list[str]]:
+    'Returns a copy of a board'
+    return [column[:] for column in board]
+
+
+def _open_column(board: list[list[str]]) -> int:
+    'Returns the column with the most room, so a faller placed there can fall and move'
+    return max(range(len(board)), key = lambda col: board[col].count('   '))
+
+
+def _with_faller(board: list[list[str]]) -> game_mechanics.GameState:
+    'Returns a GameState for the board with a faller placed in its emptiest column'
+    game_state = game_mechanics.GameState(_copy_board(board))
+    game_state.put_faller_in_board((_open_column(board), ['[R]', '[G]', '[B]']))
+    return game_state
+
+
+def _after_freeze(board: list[list[str]]) -> game_mechanics.GameState:
+    'Returns a GameState whose faller has just dropped to the bottom of its column and frozen'
+    game_state = _with_faller(board)
+    while not game_state.faller_in_landed():
+        game_state.faller_pass_time()
+    game_state.faller_pass_time()
+    return game_state
+
+
+def _setup_single_match(board):
+    'Times finding matches right after a faller freezes'
+    game_state = _after_freeze(board)
+    return game_state.single_match
+
+
+def _setup_still_matches(board):
+    'Times checking for matches right after a faller freezes'
+    game_state = _after_freeze(board)
+    return game_state._still_matches
+
+
+def _setup_remove_match(board):
+    'Times removing every match, or the top jewel of every column when the board has no matches'
+    game_state = game_mechanics.GameState(_copy_board(board))
+    positions = game_state.single_match()
+    if not positions:
+        for col in range(len(board)):
+            top = board[col].count('   ')
+            if top < len(board[col]):
+                positions.append((col, top))
+        positions.sort(key = lambda position: (position[1], position[0]))
+    return lambda: game_state.remove_match(positions)
+
+
+def _setup_resolve_cascades(board):
+    '''
+    Times clearing every match and letting the columns fall until the board is stable, right after a
+    faller freezes, so the timed call also searches the cells the faller wrote for matches
+    '''
+    game_state = _after_freeze(board)
+    return game_state.resolve_cascades
+
+
+def _setup_cached_resolve_cascades(board):
+    'Times settling a board whose settled result is already in a TranspositionCache'
+    cache = transposition_cache.TranspositionCache()
+    game_mechanics.GameState(_copy_board(board), cache = cache).resolve_cascades()
+    game_state = game_mechanics.GameState(_copy_board(board), cache = cache)
+    return game_state.resolve_cascades
+
+
+def _setup_shift_down_all_empties(board):
+    'Times collapsing every column after a fifth of the jewels are knocked out'
+    holes = _copy_board(board)
+    rng = random.Random(len(board) * len(board[0]))
+    for column in holes:
+        for row in range(len(column)):
+            if column[row] != '   ' and rng.random() < 0.2:
+                column[row] = '   '
+    game_state = game_mechanics.GameState(holes)
+    return game_state.shift_down_all_empties
+
+
+def _setup_faller_pass_time(board):
+    'Times dropping a newly placed faller by one row'
+    game_state = _with_faller(board)
+    return game_state.faller_pass_time
+
+
+def _setup_faller_move_delta(board):
+    'Times moving a faller one column sideways'
+    game_state = _with_faller(board)
+    delta = 1 if _open_column(board) + 1 < len(board) else -1
+    return lambda: game_state.faller_move_delta(delta)
+
+
+def _setup_should_land(board):
+    'Times checking whether a newly placed faller has landed'
+    game_state = _with_faller(board)
+    return game_state._should_land
+
+
+def _setup_check_if_dead(board):
+    'Times checking whether a jewel is in the hidden rows'
+    game_state = game_mechanics.GameState(_copy_board(board))
+    return game_state.check_if_dead
+
+
+def _setup_spawn_column(board):
+    'Times picking a random non-full column for a new faller'
+    game_state = game_mechanics.GameState(_copy_board(board))
+    rng = random.Random(0)
+    return lambda: rng.choice(game_state.free_columns())
+
+
+def _setup_create_duplicate_board(board):
+    'Times copying the board'
+    game_state = game_mechanics.GameState(_copy_board(board))
+    return game_state._create_duplicate_board
+
+
+def _setup_clone(board):
+    'Times cloning a GameState and dropping its faller one row, which copies only the faller column'
+    game_state = _with_faller(board)
+
+    def clone_and_fall():
+        game_state.clone().faller_pass_time()
+    return clone_and_fall
+
+
+def _setup_to_bytes(board):
+    'Times encoding the board as bytes'
+    game_state = game_mechanics.GameState(_copy_board(board))
+    return game_state.to_bytes
+
+
+# Each setup builds a fresh GameState outside the timed region and returns the call to time
+_OPERATIONS = {
+    'single_match': _setup_single_match,
+    '_still_matches': _setup_still_matches,
+    'remove_match': _setup_remove_match,
+    'resolve_cascades': _setup_resolve_cascades,
+    'cached_resolve_cascades': _setup_cached_resolve_cascades,
+    'shift_down_all_empties': _setup_shift_down_all_empties,
+    'faller_pass_time': _setup_faller_pass_time,
+    'faller_move_delta': _setup_faller_move_delta,
+    '_should_land': _setup_should_land,
+    'check_if_dead': _setup_check_if_dead,
+    'spawn_column': _setup_spawn_column,
+    '_create_duplicate_board': _setup_create_duplicate_board,
+    'clone': _setup_clone,
+    'to_bytes': _setup_to_bytes,
+}
+
+
+def measure(setup, board: list[list[str]]) -> dict:
+    '''
+    Times one call per fresh setup until the time budget runs out, then makes one more call under
+    tracemalloc to record its peak memory and the memory blocks it left allocated
+    '''
+    durations = []
+    started = time.perf_counter()
+    while len(durations) < _MIN_RUNS or (len(durations) < _MAX_RUNS and time.perf_counter() - started < _TIME_BUDGET):
+        operation = setup(board)
+        before = time.perf_counter_ns()
+        operation()
+        durations.append(time.perf_counter_ns() - before)
+    operation = setup(board)
+    tracemalloc.start()
+    before = _traced_blocks()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    operation()
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    after = _traced_blocks()
+    tracemalloc.stop()
+    durations.sort()
+    median = durations[len(durations) // 2]
+    return {
+        'runs': len(durations),
+        'median_ns': median,
+        'min_ns': durations[0],
+        'ops_per_sec': 1e9 / median if median else float('inf'),
+        'peak_bytes': peak,
+        'retained_blocks': sum(stat.count_diff for stat in after.compare_to(before, 'filename')),
+    }
+
+
+def _traced_blocks() -> tracemalloc.Snapshot:
+    'Takes a snapshot of the memory blocks tracemalloc traces, leaving out the ones tracemalloc allocated itself'
+    return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+
+def run_benchmarks(sizes: list[tuple[int, int]], seed: int, operations: list[str]) -> list[dict]:
+    'Benchmarks every operation on every scenario at every size and returns one result per combination'
+    results = []
+    for rows, columns in sizes:
+        for scenario in _SCENARIOS:
+            board = generate_board(rows, columns, scenario, random.Random(f'{seed}-{rows}x{columns}-{scenario}'))
+            for name in operations:
+                result = {'size': f'{rows}x{columns}', 'scenario': scenario, 'operation': name}
+                result.update(measure(_OPERATIONS[name], board))
+                results.append(result)
+                print(f"{result['size']:>9} {scenario:<14} {name:<24} {result['ops_per_sec']:>12.0f} ops/s "
+                      f"{result['peak_bytes']:>10} B peak {result['retained_blocks']:>6} blocks", flush = True)
+    return results
+
+
+def find_regressions(results: list[dict], baseline: list[dict], threshold: float) -> list[str]:
+    'Returns a description of every result slower than the matching baseline result by more than threshold'
+    baseline_by_key = {(result['size'], result['scenario'], result['operation']): result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline_by_key.get((result['size'], result['scenario'], result['operation']))
+        if previous is not None and result['ops_per_sec'] < previous['ops_per_sec'] * (1 - threshold):
+            regressions.append(f"{result['size']} {result['scenario']} {result['operation']}: "
+                               f"{result['ops_per_sec']:.0f} ops/s, was {previous['ops_per_sec']:.0f}")
+    return regressions
+
+
+def find_missed_targets(results: list[dict]) -> list[str]:
+    'Returns a description of every result on a board of at least TARGET_CELLS cells slower than its per-tick target'
+    missed = []
+    for result in results:
+        rows, columns = _parse_sizes(result['size'])[0]
+        target = TICK_TARGETS_MS.get(result['operation'])
+        if target is not None and rows * columns >= TARGET_CELLS and result['median_ns'] / 1e6 > target:
+            missed.append(f"{result['size']} {result['scenario']} {result['operation']}: "
+                          f"{result['median_ns'] / 1e6:.3f}ms, target {target}ms")
+    return missed
+
+
+def measure_startup(runs: int = _STARTUP_RUNS) -> dict[str, float]:
+    '''
+    Returns the median wall time in milliseconds of a fresh interpreter running each startup script.
+    Raises RuntimeError if a script fails, such as a headless one importing pygame
+    '''
+    environment = dict(os.environ, SDL_VIDEODRIVER = 'dummy', PYGAME_HIDE_SUPPORT_PROMPT = '1')
+    directory = os.path.dirname(os.path.abspath(__file__))
+    timings = {}
+    for name, script in _STARTUP_SCRIPTS.items():
+        if name != 'first drawn frame':
+            script = 'import sys\n' + script + _HEADLESS_CHECK
+        samples = []
+        for run in range(runs):
+            start = time.perf_counter()
+            process = subprocess.run([sys.executable, '-c', script], cwd = directory, env = environment, capture_output = True, text = True)
+            samples.append((time.perf_counter() - start) * 1000)
+            if process.returncode != 0:
+                raise RuntimeError(f'{name} failed: {process.stderr.strip()}')
+        timings[name] = statistics.median(samples)
+        print(f'{name:<24} {timings[name]:>8.1f} ms, budget {STARTUP_TARGETS_MS[name]} ms', flush = True)
+    return timings
+
+
+def _parse_sizes(text: str) -> list[tuple[int, int]]:
+    'Parses a comma-separated list of ROWSxCOLUMNS sizes'
+    sizes = []
+    for size in text.split(','):
+        rows, columns = size.lower().split('x')
+        sizes.append((int(rows), int(columns)))
+    return sizes
+
+
+def main(arguments: list[str]) -> int:
+    parser = argparse.ArgumentParser(description = 'Benchmark GameState hot paths across board sizes and fill levels')
+    parser.add_argument('--sizes', default = _DEFAULT_SIZES, help = 'comma-separated ROWSxCOLUMNS board sizes')
+    parser.add_argument('--seed', type = int, default = 0, help = 'seed used to generate the boards')
+    parser.add_argument('--operations', default = ','.join(_OPERATIONS), help = 'comma-separated operations to benchmark')
+    parser.add_argument('--output', help = 'write the results to this JSON file')
+    parser.add_argument('--compare', help = 'JSON results of an earlier run to check for regressions against')
+    parser.add_argument('--threshold', type = float, default = 0.2, help = 'allowed slowdown fraction before a regression is reported')
+    parser.add_argument('--check-targets', action = 'store_true', help = 'fail when an operation misses its per-tick cost target')
+    parser.add_argument('--check-startup', action = 'store_true', help = 'only time startup, failing when it misses a budget')
+    options = parser.parse_args(arguments)
+
+    if options.check_startup:
+        try:
+            timings = measure_startup()
+        except RuntimeError as error:
+            print('FAILED', error)
+            return 1
+        missed = [name for name, milliseconds in timings.items() if milliseconds > STARTUP_TARGETS_MS[name]]
+        for name in missed:
+            print('MISSED BUDGET', name)
+        return 1 if missed else 0
+
+    results = run_benchmarks(_parse_sizes(options.sizes), options.seed, options.operations.split(','))
+    if options.output:
+        report = {
+            'seed': options.seed,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': results,
+        }
+        with open(options.output, 'w') as output:
+            json.dump(report, output, indent = 2)
+    failed = False
+    if options.check_targets:
+        missed = find_missed_targets(results)
+        for target in missed:
+            print('MISSED TARGET', target)
+        failed = bool(missed)
+    if options.compare:
+        with open(options.compare) as baseline:
+            regressions = find_regressions(results, json.load(baseline)['results'], options.threshold)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,211 @@
+import itertools
+import operator
+
+_EMPTY = '   '
+# Turns the digits of bin() into bytes that are 0 or 1, for itertools.compress
+_DIGIT_FLAGS = bytes.maketrans(b'01', b'\x00\x01')
+_ZERO_DIGITS = b'0' * 256
+# Rebuilding every bitboard from the encoded columns costs about as much as writing an eighth of the columns one by one
+_REBUILD_FRACTION = 8
+_CELLS_READ_PER_BIT_FOUND = 40
+# The positions of every cell of a board, row by row, by board size
+_ROW_MAJOR_POSITIONS = {}
+
+# The (coldelta, rowdelta) step along each line orientation a run can follow
+LINES = ((1, 0), (0, 1), (1, 1), (-1, 1))
+
+
+class _JewelCodes(dict):
+    'Numbers the distinct jewels of a board from 1 as they are first seen, keeping 0 for an empty cell, and lists them by number'
+    def __init__(self):
+        super().__init__({_EMPTY: 0})
+        self.jewels = [_EMPTY]
+
+    def __missing__(self, jewel: str) -> int:
+        code = self[jewel] = len(self.jewels)
+        self.jewels.append(jewel)
+        return code
+
+
+class Bitboards:
+    '''
+    Holds one bitboard per distinct jewel (such as " R " or "[R]") on a game board, for scanning the
+    whole board for runs at once. Bit col * (rows + 1) + row is set when that jewel sits at
+    (col, row). The extra bit at the end of every column is always clear, so a run can never wrap from
+    one column into the next, and every column is a contiguous run of bits, so a changed column is
+    written with one operation per jewel in it.
+
+    Each column is also kept encoded as one byte per cell. A replaced column is written to the
+    bitboards when they are next scanned, and when many columns were replaced every bitboard is
+    rebuilt from the encoded columns at once instead
+    '''
+    def __init__(self, board: list[list[str]]):
+        self._columns = len(board)
+        self._rows = len(board[0])
+        self._stride = self._rows + 1
+        # Shifts that step one cell right, down, down-right and down-left, the same order as LINES
+        self._shifts = (self._stride, 1, self._stride + 1, self._stride - 1)
+        self._codes = _JewelCodes()
+        self._column_codes = [bytes(map(self._codes.__getitem__, column)) for column in board]
+        # The encoding of every replaced column as it was when the bitboards were last written
+        self._stale_columns = {}
+        # The bitboard last turned into flags by _cell_flags and its flags
+        self._flagged_bits = 0
+        self._flags = b''
+        self._rebuild()
+
+    def copy(self) -> 'Bitboards':
+        'Returns an independent copy, which costs O(columns + jewels) as the bitboards and encoded columns are immutable'
+        copy = object.__new__(Bitboards)
+        copy.__dict__.update(self.__dict__)
+        copy._boards = self._boards.copy()
+        copy._column_codes = self._column_codes[:]
+        copy._stale_columns = self._stale_columns.copy()
+        return copy
+
+    def replace(self, col: int, row: int, old: str, new: str) -> None:
+        'Records that the jewel at (col, row) changed from old to new'
+        code = self._codes[new]
+        if col not in self._stale_columns:
+            bit = 1 << (col * self._stride + row)
+            if old != _EMPTY:
+                self._boards[self._codes[old]] ^= bit
+            if new != _EMPTY:
+                self._boards[code] = self._boards.get(code, 0) | bit
+        codes = self._column_codes[col]
+        self._column_codes[col] = codes[:row] + bytes((code,)) + codes[row+1:]
+
+    def replace_column(self, col: int, start: int, cells: list[str]) -> None:
+        'Records that the cells of a column from row start on are now cells'
+        new_codes = bytes(map(self._codes.__getitem__, cells))
+        codes = self._column_codes[col]
+        self._stale_columns.setdefault(col, codes)
+        self._column_codes[col] = codes[:start] + new_codes + codes[start + len(new_codes):]
+
+    def remove_from_column(self, col: int, removed: bytes) -> int:
+        '''
+        Removes the cells of a column whose byte in removed is 1, letting the jewels above them fall,
+        and returns the first row that changed. The rows from len(removed) down are left as they are
+        '''
+        codes = self._column_codes[col]
+        bottom = len(removed)
+        # Marks each removed cell with the byte 255, which no jewel is numbered, and deletes the marks
+        marked = int.from_bytes(codes[:bottom], 'big') | int.from_bytes(removed, 'big') * 255
+        kept = marked.to_bytes(bottom, 'big').translate(None, b'\xff')
+        self._stale_columns.setdefault(col, codes)
+        self._column_codes[col] = bytes(bottom - len(kept)) + kept + codes[bottom:]
+        return min(len(codes) - len(codes.lstrip(b'\0')), bottom)
+
+    def remove_cells(self, bits: int) -> list[tuple[int, int, int]]:
+        '''
+        Removes the cells set in a bitboard, letting the jewels above them fall, and returns every
+        column that changed with its first changed row and the row after its lowest removed cell.
+        The whole board is marked at once, so only the columns with removed cells are looked at twice
+        '''
+        flags = self._cell_flags(bits)
+        board_codes = b'\xfe'.join(self._column_codes)
+        # Marks each removed cell with the byte 255 and the end of each column with 254, which no jewel is numbered
+        marked = int.from_bytes(board_codes, 'little') | int.from_bytes(flags, 'little') * 255
+        changed = []
+        for col, column in enumerate(marked.to_bytes(len(board_codes), 'little').split(b'\xfe')):
+            bottom = column.rfind(255) + 1
+            if bottom:
+                codes = self._column_codes[col]
+                kept = column[:bottom].translate(None, b'\xff')
+                self._stale_columns.setdefault(col, codes)
+                self._column_codes[col] = bytes(bottom - len(kept)) + kept + codes[bottom:]
+                changed.append((col, min(len(codes) - len(codes.lstrip(b'\0')), bottom), bottom))
+        return changed
+
+    def drop_column(self, col: int) -> tuple[int, int]:
+        '''
+        Lets the jewels of a column fall into the empty cells below them, and returns the first row
+        that changed and the row after the last, which are equal when nothing moved
+        '''
+        codes = self._column_codes[col]
+        top = len(codes) - len(codes.lstrip(b'\0'))
+        bottom = codes.rfind(0) + 1
+        if bottom <= top:
+            return top, top
+        kept = codes[top:bottom].translate(None, b'\0')
+        self._stale_columns.setdefault(col, codes)
+        self._column_codes[col] = bytes(bottom - len(kept)) + kept + codes[bottom:]
+        return top, bottom
+
+    def column(self, col: int) -> list[str]:
+        'Returns the jewels of a column, top first'
+        return list(map(self._codes.jewels.__getitem__, self._column_codes[col]))
+
+    def line_run_cells(self) -> list[int]:
+        'Returns one bitboard per orientation in LINES of the cells in three or more identical jewels in a row along it'
+        self._write_stale_columns()
+        runs = []
+        for shift in self._shifts:
+            line_runs = 0
+            for bits in self._boards.values():
+                starts = bits & (bits >> shift) & (bits >> 2 * shift)
+                if starts:
+                    line_runs |= starts | (starts << shift) | (starts << 2 * shift)
+            runs.append(line_runs)
+        return runs
+
+    def _write_stale_columns(self) -> None:
+        'Writes the columns replaced since the bitboards were last written to them, one by one or by rebuilding every bitboard'
+        if len(self._stale_columns) * _REBUILD_FRACTION >= self._columns:
+            self._rebuild()
+            return
+        for col, old_codes in self._stale_columns.items():
+            codes = self._column_codes[col]
+            shift = col * self._stride
+            for code in set(old_codes).union(codes):
+                if code:
+                    table = _ZERO_DIGITS[:code] + b'1' + _ZERO_DIGITS[code+1:]
+                    changed = int(old_codes.translate(table)[::-1], 2) ^ int(codes.translate(table)[::-1], 2)
+                    if changed:
+                        self._boards[code] = self._boards.get(code, 0) ^ (changed << shift)
+        self._stale_columns.clear()
+
+    def _rebuild(self) -> None:
+        'Builds every bitboard from the encoded columns, each followed by the always clear bit'
+        # Reversed once here, as int() reads the highest bit first
+        board_codes = b'\0'.join(self._column_codes)[::-1]
+        self._boards = {}
+        for code in range(1, len(self._codes.jewels)):
+            if code in board_codes:
+                self._boards[code] = int(board_codes.translate(_ZERO_DIGITS[:code] + b'1' + _ZERO_DIGITS[code+1:]), 2)
+        self._stale_columns.clear()
+
+    def bit(self, col: int, row: int) -> int:
+        'Returns the bitboard with only (col, row) set'
+        return 1 << (col * self._stride + row)
+
+    def _cell_flags(self, bits: int) -> bytes:
+        'Returns the bits of a bitboard as bytes that are 0 or 1, lowest first, reusing them when asked for the same bitboard again'
+        if bits is not self._flagged_bits:
+            self._flags = bin(bits)[:1:-1].encode().translate(_DIGIT_FLAGS)
+            self._flagged_bits = bits
+        return self._flags
+
+    def positions(self, bits: int) -> list[tuple[int, int]]:
+        'Returns the (col, row) positions of the set bits of a bitboard, sorted by row and then by column'
+        flags = self._cell_flags(bits)
+        # Finding a set bit costs about as much as reading the flags of a few dozen cells
+        if bits.bit_count() * _CELLS_READ_PER_BIT_FOUND < len(flags):
+            positions = []
+            index = flags.find(1)
+            while index >= 0:
+                positions.append(divmod(index, self._stride))
+                index = flags.find(1, index + 1)
+            return sorted(positions, key = operator.itemgetter(1))
+        flags += bytes(self._columns * self._stride - len(flags))
+        row_flags = b''.join([flags[row::self._stride] for row in range(self._rows)])
+        return list(itertools.compress(_row_major_positions(self._columns, self._rows), row_flags))
+
+
+def _row_major_positions(columns: int, rows: int) -> list[tuple[int, int]]:
+    'Returns the (col, row) position of every cell of a board of the given size, row by row. Every board of the same size shares them'
+    positions = _ROW_MAJOR_POSITIONS.get((columns, rows))
+    if positions is None:
+        positions = [(col, row) for row in range(rows) for col in range(columns)]
+        _ROW_MAJOR_POSITIONS[(columns, rows)] = positions
+    return positions
@@ -0,0 +1,336 @@
+from typing import NamedTuple
+import numpy as np
+import game_mechanics
+import transposition_cache
+
+# Each cell is a single byte of the game_mechanics encoding: the low three bits hold the jewel
+# color and the next two bits hold the state the jewel is in. A cell equal to EMPTY holds no jewel.
+EMPTY = 0
+FROZEN = 0
+FALLING = 1
+LANDED = 2
+MATCHING = 3
+
+_COLOR_MASK = 0b111
+_STATE_SHIFT = 3
+_LINES = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+
+encode_cell = game_mechanics.encode_cell
+decode_cell = game_mechanics.decode_cell
+
+
+def encode_board(board: list[list[str]]) -> np.ndarray:
+    'Returns a uint8 array of shape (columns, rows) encoding a list-of-lists game board'
+    return np.array([[game_mechanics.CELL_CODES[cell] for cell in col] for col in board], dtype = np.uint8).reshape(len(board), -1)
+
+
+def decode_board(cells: np.ndarray) -> list[list[str]]:
+    'Returns the list-of-lists game board represented by a uint8 array of shape (columns, rows)'
+    return _SYMBOL_TABLE[cells].tolist()
+
+
+def cell_colors(cells: np.ndarray) -> np.ndarray:
+    'Returns the color index (0 for empty, 1-7 for "ROYGBIV") of every cell'
+    return cells & _COLOR_MASK
+
+
+def cell_states(cells: np.ndarray) -> np.ndarray:
+    'Returns the state (FROZEN, FALLING, LANDED or MATCHING) of every cell'
+    return cells >> _STATE_SHIFT
+
+
+def with_state(cells: np.ndarray, state: int) -> np.ndarray:
+    'Returns the given cells with their color kept and their state replaced'
+    return (cells & _COLOR_MASK) | (state << _STATE_SHIFT)
+
+
+def run_mask(cells: np.ndarray) -> np.ndarray:
+    '''
+    Returns a boolean mask of every cell that is part of three or more identical jewels in a row,
+    vertically, horizontally or diagonally. The last two axes of cells are (columns, rows), so a
+    stack of boards with shape (boards, columns, rows) is handled in one call
+    '''
+    mask = np.zeros(cells.shape, dtype = bool)
+    columns, rows = cells.shape[-2:]
+    for coldelta, rowdelta in _LINES:
+        width = columns - 2 * coldelta
+        height = rows - 2 * abs(rowdelta)
+        if width <= 0 or height <= 0:
+            continue
+        row_start = 2 if rowdelta < 0 else 0
+        windows = [(slice(i * coldelta, i * coldelta + width), slice(row_start + i * rowdelta, row_start + i * rowdelta + height))
+                   for i in range(3)]
+        first = cells[(...,) + windows[0]]
+        starts = (first != EMPTY) & (first == cells[(...,) + windows[1]]) & (first == cells[(...,) + windows[2]])
+        for window in windows:
+            mask[(...,) + window] |= starts
+    return mask
+
+
+def compact_columns(cells: np.ndarray) -> np.ndarray:
+    'Returns the cells with every empty position shifted to the top of its column'
+    order = np.argsort(cells != EMPTY, axis = -1, kind = 'stable')
+    return np.take_along_axis(cells, order, axis = -1)
+
+
+class ArraySnapshot(NamedTuple):
+    '''
+    The state of an ArrayGameState at one moment, taken by snapshot() and put back by restore().
+    The board array is a read-only copy
+    '''
+    cells: np.ndarray
+    hidden_rows: int
+    faller_column: int | None
+    faller_top: int
+    faller_length: int
+
+
+class ArrayGameState(game_mechanics.GameState):
+    '''
+    A GameState that stores its board as a compact uint8 array instead of a list of lists of strings.
+    State transitions are applied to the whole board at once, and return_board() decodes the
+    array into the list-of-lists format for code that reads the board directly. Results are never
+    cached, and the Zobrist hash is computed from the whole board when it is asked for
+    '''
+    def __init__(self, board: list[list[str]], faller_length: int = 3):
+        self._cells = encode_board(board)
+        self._hidden_rows = faller_length - 1
+        self._cache = None
+        cols, rows = np.nonzero(self._faller_cells())
+        self._faller_column = int(cols[0]) if len(cols) else None
+        self._faller_top = int(rows.min()) if len(rows) else 0
+        self._faller_length = len(rows)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, cache: transposition_cache.TranspositionCache = None) -> 'ArrayGameState':
+        'Creates an ArrayGameState from the encoding returned by to_bytes(). Results are never cached, so a cache raises ValueError'
+        if cache is not None:
+            raise ValueError('ArrayGameState does not cache results')
+        board, hidden_rows = game_mechanics.board_from_bytes(data)
+        return cls(board, hidden_rows + 1)
+
+    def return_board(self) -> list[list[str]]:
+        'Returns a list-of-lists view of the current game board. Changes to the view do not affect the game'
+        return decode_board(self._cells)
+
+    def return_cells(self) -> np.ndarray:
+        'Returns the uint8 array holding the current game board'
+        return self._cells
+
+    def return_faller(self) -> tuple[int, list[str]] | None:
+        'Returns the column and the jewels, top first, of the faller, or None when there is no faller'
+        if self._faller_column is None:
+            return None
+        return (self._faller_column, [game_mechanics.CELL_SYMBOLS[code] for code in self._cells[self._faller_column, self._faller_rows()]])
+
+    def zobrist_hash(self) -> int:
+        'Returns the 64-bit hash of the board that GameState keeps, computed from the whole board'
+        columns, rows = self._cells.shape
+        jewels = zip(np.flatnonzero(self._cells).tolist(), self._cells[self._cells != EMPTY].tolist())
+        return game_mechanics.zobrist_hash(columns, rows, jewels)
+
+    def snapshot(self) -> ArraySnapshot:
+        'Returns the current state of the game, holding a read-only copy of the board array'
+        cells = self._cells.copy()
+        cells.flags.writeable = False
+        return ArraySnapshot(cells, self._hidden_rows, self._faller_column, self._faller_top, self._faller_length)
+
+    def restore(self, snapshot: ArraySnapshot) -> None:
+        'Puts the game back into the state of a snapshot, which can be restored again later'
+        self._cells = snapshot.cells.copy()
+        self._hidden_rows = snapshot.hidden_rows
+        self._faller_column = snapshot.faller_column
+        self._faller_top = snapshot.faller_top
+        self._faller_length = snapshot.faller_length
+
+    def clone(self) -> 'ArrayGameState':
+        'Returns an independent copy of the game'
+        clone = object.__new__(type(self))
+        clone._cells = self._cells.copy()
+        clone._hidden_rows = self._hidden_rows
+        clone._cache = self._cache
+        clone._faller_column = self._faller_column
+        clone._faller_top = self._faller_top
+        clone._faller_length = self._faller_length
+        return clone
+
+    def to_bytes(self) -> bytes:
+        'Encodes the game board in one byte per cell, column by column, after a short header giving its size'
+        columns, rows = self._cells.shape
+        return game_mechanics.BOARD_HEADER.pack(columns, rows, self._hidden_rows) + self._cells.tobytes()
+
+    def put_faller_in_board(self, faller: tuple[int, list[str]]):
+        'Places a faller into the game board. If the faller should immediately land, it does'
+        column, content = faller
+        self._cells[column, :len(content)] = [game_mechanics.CELL_CODES[jewel] for jewel in content]
+        self._faller_column = column
+        self._faller_top = 0
+        self._faller_length = len(content)
+        if self._should_land():
+            self._land()
+
+    def faller_pass_time(self):
+        'Handles the passage of time of a faller as it drops into the game board until freezing. If the faller should land, it does'
+        if self.faller_in_landed():
+            self._freeze()
+            return
+        if self._faller_column is None:
+            return
+        rows = self._faller_rows()
+        self._cells[self._faller_column, rows.start+1:rows.stop+1] = self._cells[self._faller_column, rows]
+        self._cells[self._faller_column, rows.start] = EMPTY
+        self._faller_top += 1
+        if self._should_land():
+            self._land()
+
+    def faller_move_delta(self, delta: int) -> int | None:
+        '''
+        Moves a faller in delta direction, with +1 representing right and -1 representing to left.
+        If the faller should land , it lands. If movement causes the faller to unland, it unlands
+        Returns the column that the faller is in after movement, or None when there is no faller
+        '''
+        if self._faller_column is None:
+            return None
+        self._move_faller_delta(delta)
+        if self._should_land():
+            self._land()
+        else:
+            self._unland()
+        return self._faller_column
+
+    def faller_reverse(self):
+        'Reverses a faller, moving the bottom jewel to the top and every other jewel down by one'
+        if self._faller_column is not None:
+            rows = self._faller_rows()
+            self._cells[self._faller_column, rows] = np.roll(self._cells[self._faller_column, rows], 1)
+
+    def check_if_dead(self) -> bool:
+        'Checks if it should be GAME OVER at a frozen state'
+        return bool(self._cells[:, :self._hidden_rows].any())
+
+    def faller_in_landed(self) -> bool:
+        'Determines if a faller is in landed position'
+        return bool((self._cells_in_state(LANDED)).any())
+
+    def faller_in_frozen(self) -> bool:
+        'Determines if a faller is in frozen position'
+        return not cell_states(self._cells).any()
+
+    def faller_in_matching(self) -> bool:
+        return bool((self._cells_in_state(MATCHING)).any())
+
+    def single_match(self) -> list[tuple[int,int]]:
+        'Determines the index positions of all jewels matching sequence, sorted by row and then by column'
+        cols, rows = np.nonzero(run_mask(self._cells))
+        order = np.lexsort((cols, rows))
+        return list(zip(cols[order].tolist(), rows[order].tolist()))
+
+    def remove_match(self, positions) -> None:
+        'Removes index positions in a list from the game board'
+        removed = np.zeros(self._cells.shape, dtype = bool)
+        for position in positions:
+            removed[position] = True
+        for col in np.flatnonzero(removed.any(axis = 1)):
+            remaining = self._cells[col][~removed[col]]
+            self._cells[col] = EMPTY
+            self._cells[col, len(self._cells[col]) - len(remaining):] = remaining
+
+    def _cascade(self) -> list[game_mechanics.CascadeStep]:
+        'Clears every match at once and lets the columns fall until no matches are left, returning a CascadeStep per round'
+        steps = []
+        positions = self.single_match()
+        while positions:
+            self.remove_match(positions)
+            steps.append(game_mechanics.CascadeStep(len(steps) + 1, len(positions), positions))
+            positions = self.single_match()
+        return steps
+
+    def add_signal(self, positions) -> None:
+        'Adds the matching to signal to specified positions contained within a list'
+        if positions:
+            cols, rows = zip(*positions)
+            self._cells[cols, rows] = with_state(self._cells[cols, rows], MATCHING)
+
+    def _still_matches(self) -> bool:
+        'Determines if there are still possible matches left on the board'
+        return bool(run_mask(self._cells).any())
+
+    def shift_down_all_empties(self):
+        'Shifts down all empty positions in the game board'
+        self._cells = compact_columns(self._cells)
+        if self._faller_column is not None:
+            self._faller_top = int(np.flatnonzero(self._faller_cells()[self._faller_column])[0])
+
+    def column_is_full(self, column: int) -> bool:
+        'Determines if a column is full of frozen pieces'
+        return bool(self._cells[column, self._hidden_rows:].all())
+
+    def free_columns(self) -> list[int]:
+        'Returns the columns that are not full, in order'
+        return np.flatnonzero(~self._cells[:, self._hidden_rows:].all(axis = 1)).tolist()
+
+    def _should_land(self) -> bool:
+        'Determines if the faller should land, which is when it rests on a jewel or on the bottom of the board'
+        below = self._faller_rows().stop
+        return below == self._board_rows() or self._cells[self._faller_column, below] != EMPTY
+
+    def _can_move_faller_delta(self, delta: int) -> bool:
+        'Determines if a faller can move in a direction indicated by delta, with 1 representing right and -1 representing left'
+        target = self._faller_column + delta
+        if not 0 <= target < self._board_columns():
+            return False
+        return not self._cells[target, self._faller_rows()].any()
+
+    def _move_faller_delta(self, delta: int) -> None:
+        'Moves a faller in delta direction, with 1 representing right and -1 representing left'
+        if self._can_move_faller_delta(delta):
+            rows = self._faller_rows()
+            self._cells[self._faller_column + delta, rows] = self._cells[self._faller_column, rows]
+            self._cells[self._faller_column, rows] = EMPTY
+            self._faller_column += delta
+
+    def _land(self):
+        'lands a faller'
+        self._change_state(FALLING, LANDED)
+
+    def _unland(self):
+        'unlands a faller'
+        self._change_state(LANDED, FALLING)
+
+    def _freeze(self):
+        'freezes a faller'
+        self._change_state(LANDED, FROZEN)
+        self._faller_column = None
+
+    def _create_duplicate_board(self) -> list[list[str]]:
+        'returns a duplicate of the current game board'
+        return decode_board(self._cells)
+
+    def _board_columns(self) -> int:
+        'Returns the number of columns on the given game board'
+        return self._cells.shape[0]
+
+    def _board_rows(self) -> int:
+        'Returns the number of rows on the given game board'
+        return self._cells.shape[1]
+
+    def _cells_in_state(self, state: int) -> np.ndarray:
+        'Returns a boolean mask of the jewels that are in the given state'
+        return (self._cells != EMPTY) & (cell_states(self._cells) == state)
+
+    def _faller_rows(self) -> slice:
+        'Returns the rows covered by the faller'
+        return slice(self._faller_top, self._faller_top + self._faller_length)
+
+    def _faller_cells(self) -> np.ndarray:
+        'Returns a boolean mask of the jewels that belong to a falling or landed faller'
+        return self._cells_in_state(FALLING) | self._cells_in_state(LANDED)
+
+    def _change_state(self, old_state: int, new_state: int) -> None:
+        'Moves every jewel in old_state into new_state'
+        in_old_state = self._cells_in_state(old_state)
+        self._cells[in_old_state] = with_state(self._cells[in_old_state], new_state)
+
+
+_SYMBOL_TABLE = np.array(list(game_mechanics.CELL_SYMBOLS) + ['   '] * (256 - len(game_mechanics.CELL_SYMBOLS)), dtype = object)
@@ -1,47 +1,224 @@
-import pygame
+import argparse
+import command_line
+import frame_profiler
+import frame_scheduler
 import game_mechanics
+import placement_search
 import random
-
-_INITIAL_WIDTH = 360
-_INITIAL_HEIGHT = 780
+import struct
+import sys
+import time
+from typing import Callable, Iterable, NamedTuple
+
+_CELL_PIXELS = 60
+_MAX_INITIAL_WIDTH = 1600
+_MAX_INITIAL_HEIGHT = 900
 _FRAME_RATE = 30
-_BACKGROUND_COLOR = pygame.Color(000, 000, 000)
+_BACKGROUND_COLOR = (0, 0, 0)
+_TEXT_COLOR = (255, 255, 255)
+_JEWEL_COLORS = {'R': (255, 0, 0), 'O': (255, 165, 0), 'Y': (255, 255, 0), 'G': (0, 128, 0), 'B': (0, 0, 255), 'I': (75, 0, 130),
+                 'V': (238, 130, 238), ' ': (0, 0, 0, 0), '|': (192, 192, 192)}
+_PROFILE_FONT_SIZE = 18
+_COMMANDS = ('left', 'right', 'reverse')
+_PROFILED_PHASES = ('_handle_events', '_pass_time', '_determine_if_should_match', '_draw_frame', '_end_game_on_death')
+_OVERLAY_REFRESH_FRAMES = 10
+# The frames played, fallers created, frame timer and matching flag at the start of the encoding from to_bytes()
+_GAME_HEADER = struct.Struct('<IIB?')
+# pygame is imported by _import_pygame() when a window is opened, so headless games and the tools
+# that import this module do not load it. Fonts are loaded on first use and cached by size
+pygame = None
+# array_renderer, which needs numpy, is imported by _import_array_renderer() only when it draws the board
+array_renderer = None
+_fonts = {}
+
+
+class HeadlessRun(NamedTuple):
+    'The outcome of a game run without a display'
+    frames: int
+    seconds: float
+    frames_per_second: float
+    game_over: bool
+
 
 class ColumnsGame:
-    def __init__(self):
-        self._game_state = game_mechanics.GameState(create_empty_board(13,6))
+    def __init__(self, rows: int = 13, columns: int = 6, faller_length: int = 3, rng: random.Random = None,
+                 profiler: frame_profiler.FrameProfiler = None, show_profile: bool = False, render_rate: float = None,
+                 recorder: 'game_log.GameRecorder' = None, fallers: Iterable[tuple[int, list[str]]] = None, renderer: str = 'sprites'):
+        '''
+        Creates a game on an empty board. Fallers are random unless fallers gives the ones to put into
+        the board in order, as when replaying a log; the game ends when they run out. A recorder, if
+        given, is told about every faller, command and frame. renderer is 'sprites' to redraw the jewels
+        that changed each frame, or 'array' to draw the whole board in one blit with array_renderer
+        '''
+        self._rows = rows
+        self._columns = columns
+        self._faller_length = faller_length
+        self._game_state = game_mechanics.GameState(game_mechanics.create_empty_board(rows, columns, faller_length - 1), faller_length)
+        self._random = random if rng is None else rng
         self._game_active = True
         self._display_game = True
         self._in_matching = False
+        self._fallers_created = 0
+        self._frames = 0
         self._frame_timer = _FRAME_RATE
-        self._color_dictionary = {'R': pygame.Color(255,0,0), 'O': pygame.Color(255,165,0), 'Y': pygame.Color(255,255,0), 'G': pygame.Color(0,128,0),
-        'B': pygame.Color(0,0,255), 'I': pygame.Color(75,0,130), 'V': pygame.Color(238,130,238), ' ': pygame.Color(0,0,0,0), '|': pygame.Color(192,192,192)}
+        self._recorder = recorder
+        self._fallers = None if fallers is None else iter(fallers)
+        self._render_rate = render_rate
+        self._renderer = renderer
+        self._array_renderer = None
+        self._profile_overlay = None
+        self._pending_events = []
+        self._profiler = profiler
+        self._show_profile = show_profile and profiler is not None
+        if profiler is not None:
+            self._instrument(profiler)
+        if recorder is not None:
+            recorder.record_keyframe(0, self.to_bytes())
+
+    @classmethod
+    def from_bytes(cls, data: bytes, fallers: Iterable[tuple[int, list[str]]] = None, rng: random.Random = None) -> 'ColumnsGame':
+        'Creates a game in the state encoded by to_bytes(), which then plays on with the given fallers, or random ones'
+        frames, fallers_created, frame_timer, in_matching = _GAME_HEADER.unpack_from(data)
+        columns, rows, hidden_rows = game_mechanics.BOARD_HEADER.unpack_from(data, _GAME_HEADER.size)
+        game = cls(rows - hidden_rows, columns, hidden_rows + 1, rng = rng, fallers = fallers)
+        game._game_state = game_mechanics.GameState.from_bytes(data[_GAME_HEADER.size:])
+        game._frames = frames
+        game._fallers_created = fallers_created
+        game._frame_timer = frame_timer
+        game._in_matching = in_matching
+        return game
 
     def run(self) -> None:
+        '''
+        Runs the game in a pygame window. The game logic advances _FRAME_RATE frames per second of
+        wall-clock time whatever the render rate, and between frames the loop sleeps until an event
+        arrives or the next frame or render is due
+        '''
+        _import_pygame()
+        if self._renderer == 'array':
+            _import_array_renderer()
         pygame.init()
 
         try:
-            clock = pygame.time.Clock()
-            self._create_surface((_INITIAL_WIDTH, _INITIAL_HEIGHT))
+            scheduler = frame_scheduler.FixedStepScheduler(_FRAME_RATE, self._render_rate)
+            self._create_surface(self._initial_size())
+            render_pending = True
             while self._game_active:
-                clock.tick(_FRAME_RATE)
-                if self._game_state.faller_in_frozen() and not self._in_matching:
-                    faller = self._create_faller()
-                    self._game_state.put_faller_in_board(faller)
-                    column = faller[0]
-                    index_to_be_removed = 3
-                # Creates a faller and inserts it into the board when appropiate (not in matching and board is in frozen)
-                if not self._in_matching:
-                    column = self._handle_events(column, index_to_be_removed)
-                index_to_be_removed = self._pass_time(column, index_to_be_removed)
-                self._determine_if_should_match()
-                self._draw_frame()
-                self._end_game_on_death()
+                self._wait_for_event(scheduler, render_pending)
+                frames = scheduler.steps_due()
+                if frames and self._profiler is not None:
+                    self._profiler.start_frame()
+                for frame in range(frames):
+                    self._advance_frame(self._handle_events)
+                    render_pending = True
+                    if not self._game_active:
+                        break
+                if render_pending and scheduler.render_due():
+                    self._draw_frame()
+                    render_pending = False
+                if frames and self._profiler is not None:
+                    self._end_profiled_frame()
             if self._display_game:
                 self._show_board_until_exit()
         finally:
+            _fonts.clear()
             pygame.quit()
 
+    def run_headless(self, input_source: Callable[[int], Iterable[str]] = None, max_frames: int = None) -> HeadlessRun:
+        '''
+        Runs the game logic without pygame, a display or frame throttling until the game ends or max_frames pass.
+        input_source is called with the frame number and returns the faller commands ("left", "right" or "reverse") for that frame
+        '''
+        frames = 0
+        start = time.perf_counter()
+        while self._game_active and (max_frames is None or frames < max_frames):
+            if self._profiler is not None:
+                self._profiler.start_frame()
+            self.advance_frame(input_source, self._frames)
+            if self._profiler is not None:
+                self._profiler.end_frame()
+            frames += 1
+        seconds = time.perf_counter() - start
+        frames_per_second = frames / seconds if seconds > 0 else float('inf')
+        return HeadlessRun(frames, seconds, frames_per_second, not self._game_active)
+
+    def advance_frame(self, input_source: Callable[[int], Iterable[str]] = None, frame: int = 0) -> bool:
+        '''
+        Advances the game logic by one frame without a display. input_source is called with frame, as in
+        run_headless, only if the faller can be controlled. Returns whether the game is still going
+        '''
+        if input_source is None:
+            self._advance_frame(lambda: None)
+        else:
+            self._advance_frame(lambda: self._handle_commands(input_source(frame)))
+        return self._game_active
+
+    def return_game_state(self) -> game_mechanics.GameState:
+        'Returns the GameState being played'
+        return self._game_state
+
+    def return_fallers_created(self) -> int:
+        'Returns how many fallers have been put into the board so far'
+        return self._fallers_created
+
+    def return_frames(self) -> int:
+        'Returns how many frames of game logic have been played'
+        return self._frames
+
+    def is_active(self) -> bool:
+        'Returns whether the game is still going'
+        return self._game_active
+
+    def to_bytes(self) -> bytes:
+        'Encodes the state of the game: the frames played, the timers and the board as GameState.to_bytes encodes it'
+        return _GAME_HEADER.pack(self._frames, self._fallers_created, self._frame_timer, self._in_matching) + self._game_state.to_bytes()
+
+    def _advance_frame(self, handle_input: Callable[[], None]) -> None:
+        'Advances the game logic by one frame, calling handle_input to apply faller commands when the faller can be controlled'
+        self._play_frame(handle_input)
+        self._frames += 1
+        if self._recorder is not None:
+            self._recorder.end_frame(self._frames, self._game_active, self.to_bytes)
+
+    def _play_frame(self, handle_input: Callable[[], None]) -> None:
+        'Creates a faller if the last one froze, applies input and passes time, and ends the game if the board is full'
+        if self._game_state.faller_in_frozen() and not self._in_matching:
+            faller = self._create_faller()
+            if faller is None:
+                return
+            self._game_state.put_faller_in_board(faller)
+            self._fallers_created += 1
+            if self._recorder is not None:
+                self._recorder.record_faller(self._frames, faller)
+        # Creates a faller and inserts it into the board when appropiate (not in matching and board is in frozen)
+        if not self._in_matching:
+            handle_input()
+        self._pass_time()
+        self._determine_if_should_match()
+        self._end_game_on_death()
+
+    def _instrument(self, profiler: frame_profiler.FrameProfiler) -> None:
+        'Replaces the phases of a frame with versions that report their timings to the profiler'
+        for phase in _PROFILED_PHASES:
+            setattr(self, phase, profiler.timed(phase.lstrip('_'), getattr(self, phase)))
+        profiler.instrument_game_state(self._game_state)
+
+    def _end_profiled_frame(self) -> None:
+        'Ends the profiled frame, and every few frames draws the profiler summary over the top left of the board'
+        self._profiler.end_frame()
+        if self._show_profile and self._frames % _OVERLAY_REFRESH_FRAMES == 0:
+            font = _system_font(_PROFILE_FONT_SIZE)
+            lines = [font.render(line, True, _TEXT_COLOR) for line in self._profiler.summary_lines()]
+            overlay = pygame.Surface((max(line.get_width() for line in lines), sum(line.get_height() for line in lines)))
+            overlay.fill(_BACKGROUND_COLOR)
+            y = 0
+            for line in lines:
+                overlay.blit(line, (0, y))
+                y += line.get_height()
+            # The array renderer redraws the whole board each frame, so it blits the overlay again after it
+            self._profile_overlay = overlay
+            pygame.display.update(self._surface.blit(overlay, (0, 0)))
+
     def _game_board(self) -> list[list[str]]:
         'Returns the game board of a GameState object'
         return self._game_state.return_board()
@@ -51,10 +228,13 @@ class ColumnsGame:
         Shows the board after the game has ended to allow users to 
         figure out how they lost until they manually exit the pygame window
         '''
+        self._draw_frame()
         self._generate_game_over_image()
+        events = self._pending_events
+        self._pending_events = []
         while True:
             should_break = False
-            for event in pygame.event.get():
+            for event in events:
                 if event.type == pygame.QUIT:
                     should_break = True
                 elif event.type == pygame.VIDEORESIZE:
@@ -63,16 +243,16 @@ class ColumnsGame:
                     self._generate_game_over_image()
             if should_break:
                 break
+            events = [pygame.event.wait()]
 
     def _generate_game_over_image(self) -> None:
         'Adds a "GAME OVER" text image to the board'
         font_size = int(self._surface.get_width()/6)
-        font = pygame.font.SysFont(None, font_size)
-        text_image = font.render('GAME OVER', True, pygame.Color(255, 255, 255))
+        text_image = _system_font(font_size).render('GAME OVER', True, _TEXT_COLOR)
         self._surface.blit(text_image, (0, 0))
         pygame.display.flip()
             
-    def _pass_time(self, column, index_to_be_removed) -> int:
+    def _pass_time(self) -> None:
         '''
         Handles how a faller should act with the passage of time, which occurs after 1 second.
         Passage of time actions include matching, falling, landing, and freezing.
@@ -86,10 +266,8 @@ class ColumnsGame:
                 else:
                     self._game_state.add_signal(positions)
             else:
-                self._game_state.faller_pass_time(column, index_to_be_removed)
-                index_to_be_removed += 1
+                self._game_state.faller_pass_time()
             self._frame_timer = _FRAME_RATE
-        return index_to_be_removed
 
 
     def _determine_if_should_match(self) -> None:
@@ -101,39 +279,49 @@ class ColumnsGame:
 
     def _end_game_on_death(self) -> None:
         'Ends the program when the a column is frozen and full with no matches'
-        if self._game_state.check_if_dead() and self._game_state.faller_in_frozen() and not self._in_matching:
+        if self._game_state.faller_in_frozen() and not self._in_matching and self._game_state.check_if_dead():
             self._stop_game()
 
-    def _create_faller(self) -> tuple[int, list[str]]:
-        'Randomly creates a faller in a non-full column, unless all columns are full, which causes the game to end'
-        if self._check_if_all_full_columns():
+    def _create_faller(self) -> tuple[int, list[str]] | None:
+        '''
+        Randomly creates a faller in a non-full column, unless all columns are full, which causes the game to end.
+        The column is drawn uniformly from the non-full columns, which the GameState keeps up to date.
+        When the game was given its fallers, the next one is taken instead, and the game ends when they run out
+        '''
+        if self._fallers is not None:
+            faller = next(self._fallers, None)
+            if faller is None:
+                self._stop_game()
+            return faller
+        colors = ['[' + color + ']' for color in game_mechanics.JEWEL_COLORS]
+        contents = []
+        for i in range(self._faller_length):
+            contents.append(self._random.choice(colors))
+        free_columns = self._game_state.free_columns()
+        if not free_columns:
             self._stop_game()
-        while True:
-            colors = ['[R]', '[O]', '[Y]', '[G]', '[B]', '[I]', '[V]']
-            contents = []
-            for i in range(3):
-                contents.append(random.choice(colors))
-            column = random.randrange(1, 6, 1)
-            faller = (column, contents)
-            if not self._game_state.column_is_full(faller[0]):
-                break
-        return faller
-
-    def _check_if_all_full_columns(self) -> bool:
-        'checks if all columns are full of landed pieces'
-        for column in range(6):
-            if not self._game_state.column_is_full(column):
-                return False
-        return True
-
-    def _handle_events(self, column, left_off) -> None:
-        'Handles all valid pygame events and key presses. Then relays the information from handle keys regarding column'
-        for event in pygame.event.get():
-            column = self._handle_event(event, column, left_off)
-
-        return column
-
-    def _handle_event(self, event, column, left_off) -> None:
+            return None
+        return (self._random.choice(free_columns), contents)
+
+    def _handle_events(self) -> None:
+        'Handles all valid pygame events and key presses, including those that arrived while waiting'
+        events = self._pending_events + pygame.event.get()
+        self._pending_events = []
+        for event in events:
+            self._handle_event(event)
+
+    def _wait_for_event(self, scheduler: frame_scheduler.FixedStepScheduler, render_pending: bool) -> None:
+        'Sleeps until an event arrives or the next frame, or a pending render, is due. An event that arrives is kept for _handle_events'
+        timeout = scheduler.seconds_until_step()
+        if render_pending:
+            timeout = min(timeout, scheduler.seconds_until_render())
+        milliseconds = int(timeout * 1000)
+        if milliseconds > 0:
+            event = pygame.event.wait(milliseconds)
+            if event.type != pygame.NOEVENT:
+                self._pending_events.append(event)
+
+    def _handle_event(self, event) -> None:
         'Handles manual exit of the programm resizing of the pygame window, and faller commands'
         if event.type == pygame.QUIT:
             self._stop_game()
@@ -142,62 +330,149 @@ class ColumnsGame:
             self._create_surface(event.size)
         elif event.type == pygame.KEYDOWN:
             if event.key == pygame.K_LEFT:
-                return self._game_state.faller_move_delta(column, -1)
+                self._handle_command('left')
             elif event.key == pygame.K_RIGHT:
-                return self._game_state.faller_move_delta(column, 1)
+                self._handle_command('right')
             elif event.key == pygame.K_SPACE:
-                self._game_state.faller_reverse(column, left_off)
-        return column
+                self._handle_command('reverse')
+
+    def _handle_commands(self, commands: Iterable[str]) -> None:
+        'Applies a sequence of faller commands'
+        for command in commands:
+            self._handle_command(command)
+
+    def _handle_command(self, command: str) -> None:
+        'Moves the faller left or right, or reverses it'
+        if self._recorder is not None:
+            self._recorder.record_input(self._frames, command)
+        if command == 'left':
+            self._game_state.faller_move_delta(-1)
+        elif command == 'right':
+            self._game_state.faller_move_delta(1)
+        elif command == 'reverse':
+            self._game_state.faller_reverse()
 
     def _stop_game(self) -> None:
         'Changes the game active flag to false, ending the overarching pygame while game active loop'
         self._game_active = False
 
     def _create_surface(self, size: tuple[int, int]) -> None:
-        'Creates a resizable pygame surface'
+        'Creates a resizable pygame surface, discarding the sprites and drawn cells sized for the previous one'
         self._surface = pygame.display.set_mode(size, pygame.RESIZABLE)
+        self._sprites = {}
+        self._cell_pixels = None
+        self._drawn_board = None
+        self._array_renderer = None
 
     def _draw_frame(self) -> None:
-        'Draws the game board at a given frame'
-        self._surface.fill(_BACKGROUND_COLOR)
-        self._draw_board()
+        'Draws the game board at a given frame, updating only the parts of the display whose jewels changed'
+        if self._renderer == 'array':
+            self._draw_array_frame()
+            return
+        if self._drawn_board is None:
+            self._surface.fill(_BACKGROUND_COLOR)
+            self._draw_board()
+            pygame.display.flip()
+            return
+        board = self._game_board()
+        changed_rects = []
+        for col in range(len(board)):
+            if board[col] != self._drawn_board[col]:
+                for row in range(self._faller_length - 1, len(board[col])):
+                    if board[col][row] != self._drawn_board[col][row]:
+                        changed_rects.append(self._draw_jewel(col, row, board[col][row]))
+                self._drawn_board[col] = board[col][:]
+        if changed_rects:
+            pygame.display.update(changed_rects)
+
+    def _draw_array_frame(self) -> None:
+        'Draws the whole game board, and the profiler summary if shown, with the array renderer'
+        if self._array_renderer is None:
+            x_pixels, y_pixels = self._jewel_positions()
+            width_pixel = self._frac_x_to_pixel_x(1/self._columns)
+            height_pixel = self._frac_y_to_pixel_y(1/self._rows)
+            symbol_colors = {symbol: (self._determine_border_color(symbol), _JEWEL_COLORS[symbol[1]])
+                             for symbol in game_mechanics.CELL_SYMBOLS}
+            self._array_renderer = array_renderer.ArrayRenderer(self._surface.get_size(), x_pixels, y_pixels, (width_pixel, height_pixel),
+                                                                self._determine_border_width(width_pixel, height_pixel), symbol_colors,
+                                                                _BACKGROUND_COLOR, self._faller_length - 1)
+        self._array_renderer.draw(self._surface, self._game_board())
+        if self._show_profile and self._profile_overlay is not None:
+            self._surface.blit(self._profile_overlay, (0, 0))
         pygame.display.flip()
 
     def _draw_board(self) -> None:
         'Draws all indexes of the board onto a pygame surface'
-        x_fract = 0
-        y_fract = 0
-        for col in range(2, len(self._game_board()[0])):
-            for row in range(len(self._game_board())):
-                symbol = self._game_board()[row][col]
-                color = symbol[1]
-                self._draw_jewel(x_fract, y_fract, color,symbol)
-                x_fract += 1/6
+        if self._renderer == 'array':
+            self._draw_array_frame()
+            return
+        board = self._game_board()
+        for col in range(len(board)):
+            for row in range(self._faller_length - 1, len(board[col])):
+                self._draw_jewel(col, row, board[col][row])
+        self._drawn_board = [column[:] for column in board]
+
+    def _draw_jewel(self, col: int, row: int, symbol: str) -> 'pygame.Rect':
+        '''
+        Draws a jewel onto the pygame surface, with a border signaling the current state of it. Returns the area drawn.
+        Rounding can make neighbouring jewels overlap by a pixel; the overlap belongs to the jewel to the
+        right or below, so a jewel redrawn on its own never paints over a neighbour
+        '''
+        x_pixels, y_pixels = self._jewel_positions()
+        sprite = self._jewel_sprite(symbol)
+        width = sprite.get_width()
+        height = sprite.get_height()
+        if col + 1 < len(x_pixels):
+            width = min(width, x_pixels[col+1] - x_pixels[col])
+        visible_row = row - (self._faller_length - 1)
+        if visible_row + 1 < len(y_pixels):
+            height = min(height, y_pixels[visible_row+1] - y_pixels[visible_row])
+        return self._surface.blit(sprite, (x_pixels[col], y_pixels[visible_row]), (0, 0, width, height))
+
+    def _initial_size(self) -> tuple[int, int]:
+        'Returns a window size with square cells that fits the whole board on a typical screen'
+        cell_pixels = max(1, min(_CELL_PIXELS, _MAX_INITIAL_WIDTH // self._columns, _MAX_INITIAL_HEIGHT // self._rows))
+        return (cell_pixels * self._columns, cell_pixels * self._rows)
+
+    def _jewel_positions(self) -> tuple[list[int], list[int]]:
+        'Returns the left pixel of every board column and the top pixel of every visible row for the current surface size'
+        if self._cell_pixels is None:
+            x_pixels = []
             x_fract = 0
-            y_fract += 1/13
-
-    def _draw_jewel(self, x_fract, y_fract, color,symbol) -> None:
-        'Draws a jewel onto the pygame surface, with a border signaling the current state of it'
-        width_pixel = self._frac_x_to_pixel_x(1/6)
-        height_pixel = self._frac_y_to_pixel_y(1/13)
-        top_left_pixel_x = self._frac_x_to_pixel_x(x_fract)
-        top_left_pixel_y = self._frac_y_to_pixel_y(y_fract)
-        border_color = self._determine_border_color(symbol)
-        border_width = self._determine_border_width(width_pixel, height_pixel)
-        pygame.draw.rect(self._surface, pygame.Color(border_color), (top_left_pixel_x, top_left_pixel_y, width_pixel, height_pixel))
-        pygame.draw.rect(self._surface, pygame.Color(self._color_dictionary[color]), (top_left_pixel_x + 
-            border_width, top_left_pixel_y + border_width, width_pixel - border_width*2, height_pixel - border_width*2))
-
-    def _determine_border_color(self, symbol) -> pygame.Color:
+            for col in range(self._columns):
+                x_pixels.append(self._frac_x_to_pixel_x(x_fract))
+                x_fract += 1/self._columns
+            y_pixels = []
+            y_fract = 0
+            for row in range(self._rows):
+                y_pixels.append(self._frac_y_to_pixel_y(y_fract))
+                y_fract += 1/self._rows
+            self._cell_pixels = (x_pixels, y_pixels)
+        return self._cell_pixels
+
+    def _jewel_sprite(self, symbol: str) -> 'pygame.Surface':
+        'Returns the image of a jewel with its state border at the current cell size, rendering it the first time it is needed'
+        sprite = self._sprites.get(symbol)
+        if sprite is None:
+            width_pixel = self._frac_x_to_pixel_x(1/self._columns)
+            height_pixel = self._frac_y_to_pixel_y(1/self._rows)
+            border_width = self._determine_border_width(width_pixel, height_pixel)
+            sprite = pygame.Surface((width_pixel, height_pixel))
+            sprite.fill(self._determine_border_color(symbol))
+            sprite.fill(_JEWEL_COLORS[symbol[1]], (border_width, border_width, width_pixel - border_width*2, height_pixel - border_width*2))
+            self._sprites[symbol] = sprite
+        return sprite
+
+    def _determine_border_color(self, symbol) -> tuple[int, int, int]:
         'Determines the color of the border of a jewel based on if it is in a landed, falling, matching, or frozen state'
         if symbol.startswith('|'):
-            border_color = pygame.Color(128,128,128)
+            border_color = (128, 128, 128)
         elif symbol.startswith('['):
-            border_color = pygame.Color(255,255,255)
+            border_color = (255, 255, 255)
         elif symbol.startswith('*'):
-            border_color = pygame.Color(255,215,0)
+            border_color = (255, 215, 0)
         else:
-            border_color = pygame.Color(0,0,0)
+            border_color = (0, 0, 0)
         return border_color
 
     def _determine_border_width(self, width_pixel, height_pixel) -> int:
@@ -224,25 +499,115 @@ class ColumnsGame:
         return int(frac * max_pixel)
 
 
-def create_empty_board(rows: int, columns: int) -> list[list[str]]:
+# Kept here for callers that built boards with columns_game before the factory moved to game_mechanics
+create_empty_board = game_mechanics.create_empty_board
+
+
+def _import_pygame() -> None:
+    'Imports pygame the first time a window is needed'
+    global pygame
+    if pygame is None:
+        import pygame
+
+
+def _import_array_renderer() -> None:
+    'Imports the array renderer the first time a window drawn with it is opened'
+    global array_renderer
+    if array_renderer is None:
+        import array_renderer
+
+
+def _system_font(size: int) -> 'pygame.font.Font':
+    'Returns the default system font at a size, loading it the first time that size is needed'
+    font = _fonts.get(size)
+    if font is None:
+        font = _fonts[size] = pygame.font.SysFont(None, size)
+    return font
+
+
+def scripted_input(script: dict[int, list[str]]) -> Callable[[int], list[str]]:
+    'Returns an input source that replays the faller commands listed for each frame number'
+    return lambda frame: script.get(frame, [])
+
+
+def random_input(rng: random.Random, commands_per_frame: float = 0.1) -> Callable[[int], list[str]]:
+    'Returns an input source that issues a random faller command on about commands_per_frame of all frames'
+    def next_commands(frame: int) -> list[str]:
+        if rng.random() < commands_per_frame:
+            return [rng.choice(_COMMANDS)]
+        return []
+    return next_commands
+
+
+def _run_headless_from_command_line(options: argparse.Namespace) -> None:
+    'Runs a seeded game with random input and no display, then reports the frame rate achieved'
+    seed = int(options.headless[0]) if options.headless else 0
+    max_frames = int(options.headless[1]) if len(options.headless) > 1 else None
+    recorder = _open_recorder(options, seed)
+    game = ColumnsGame(options.rows, options.columns, options.faller_length, rng = random.Random(seed), recorder = recorder)
+    try:
+        if options.autoplay is None:
+            result = game.run_headless(random_input(random.Random(seed)), max_frames)
+        else:
+            with placement_search.PlacementSearch(options.autoplay, seed = seed) as search:
+                result = game.run_headless(placement_search.search_input(game, search), max_frames)
+    finally:
+        if recorder is not None:
+            recorder.close()
+    print(f'{result.frames} frames in {result.seconds:.3f}s ({result.frames_per_second:.0f} frames per second), game over: {result.game_over}')
+
+
+def _run_window_from_command_line(options: argparse.Namespace) -> None:
     '''
-    Returns a columns game board based on a specified number of rows and columns. 
-    Invisible rows are added to take into account the faller that will be later added
+    Runs the game in a window, drawing the frame profiler over the board if asked to and appending its
+    reports to a file if one is named, and recording the game if asked to
     '''
-    board = []
-    for col in range(columns):
-        board.append([])
-        for row in range(rows):
-            board[-1].append('   ')
-    _add_invisible_rows(board)
-    return board
-
+    profiler = None
+    if options.profile is not None:
+        profiler = frame_profiler.FrameProfiler(_FRAME_RATE, dump_path = options.profile or None)
+    seed = random.randrange(1 << 63)
+    recorder = _open_recorder(options, seed)
+    try:
+        ColumnsGame(options.rows, options.columns, options.faller_length, rng = random.Random(seed), profiler = profiler,
+                    show_profile = profiler is not None, render_rate = options.render_rate, recorder = recorder,
+                    renderer = options.renderer).run()
+    finally:
+        if recorder is not None:
+            recorder.close()
+
+
+def _open_recorder(options: argparse.Namespace, seed: int) -> 'game_log.GameRecorder | None':
+    'Opens the game log named on the command line, if any'
+    if options.record is None:
+        return None
+    # game_log imports this module to replay games, so it is imported only when a game is recorded
+    import game_log
+    return game_log.GameRecorder(options.record, options.rows, options.columns, options.faller_length, seed)
+
+
+def _parse_command_line(arguments: list[str]) -> argparse.Namespace:
+    'Parses the board size, faller length and run mode given on the command line'
+    parser = argparse.ArgumentParser(description = 'Play Columns')
+    parser.add_argument('--rows', type = command_line.positive_int, default = 13, help = 'number of visible rows on the board')
+    parser.add_argument('--columns', type = command_line.positive_int, default = 6, help = 'number of columns on the board')
+    parser.add_argument('--faller-length', type = command_line.positive_int, default = 3, help = 'number of jewels in every faller')
+    parser.add_argument('--headless', nargs = '*', metavar = 'SEED [FRAMES]',
+                        help = 'run a seeded game with random input and no display, and report the frame rate')
+    parser.add_argument('--render-rate', type = command_line.positive_float, metavar = 'FPS',
+                        help = 'draw at most FPS times per second instead of after every frame of game logic')
+    parser.add_argument('--renderer', choices = ('sprites', 'array'), default = 'sprites',
+                        help = 'redraw the jewels that changed each frame, or draw the whole board in one blit (needs numpy)')
+    parser.add_argument('--autoplay', type = int, metavar = 'DEPTH',
+                        help = 'with --headless, play with a placement search DEPTH fallers deep instead of random input')
+    parser.add_argument('--profile', nargs = '?', const = '', metavar = 'FILE',
+                        help = 'draw frame timings over the board, appending reports to FILE if given')
+    parser.add_argument('--record', metavar = 'FILE', help = 'record the game to a log that game_log.GameLog can replay')
+    return parser.parse_args(arguments)
 
-def _add_invisible_rows(two_dimensional_list: list[list[str]]) -> None:
-    'Adds two invisible rows to two-dimensional array.'
-    for col in two_dimensional_list:
-        col.insert(0, '   ')
-        col.insert(0, '   ')
 
 if __name__ == '__main__':
-    ColumnsGame().run()
+    options = _parse_command_line(sys.argv[1:])
+    if options.headless is not None:
+        _run_headless_from_command_line(options)
+    else:
+        _run_window_from_command_line(options)
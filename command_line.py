@@ -0,0 +1,33 @@
+import argparse
+
+
+def positive_int(text: str) -> int:
+    'Parses a command-line whole number that must be at least 1'
+    number = _parse(text, int, 'a whole number')
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1, not {number}')
+    return number
+
+
+def non_negative_int(text: str) -> int:
+    'Parses a command-line whole number that must be at least 0'
+    number = _parse(text, int, 'a whole number')
+    if number < 0:
+        raise argparse.ArgumentTypeError(f'must be at least 0, not {number}')
+    return number
+
+
+def positive_float(text: str) -> float:
+    'Parses a command-line number that must be greater than 0'
+    number = _parse(text, float, 'a number')
+    if not number > 0:
+        raise argparse.ArgumentTypeError(f'must be greater than 0, not {number}')
+    return number
+
+
+def _parse(text: str, kind: type, description: str):
+    'Converts a command-line value to kind, reporting a value that is not one as a usage error'
+    try:
+        return kind(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'must be {description}, not {text!r}') from None
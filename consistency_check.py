@@ -0,0 +1,179 @@
+'''
+Checks the fast game engines against slow references they must agree with exactly.
+
+    python consistency_check.py [--boards 64] [--steps 3000] [--sizes 13x6,24x12,40x20] [--match-boards 3000] [--large-match-boards 4]
+
+VectorGameState steps a batch of boards with seeded random actions and spawn draws, and a
+GameStepper steps a GameState per board with the same draws; after every step each board's bytes,
+reward and done flag must be identical. single_match is then compared with a brute-force scan of
+every cell and line orientation on random boards of random sizes, before and after random writes.
+Those boards are small enough that every search rescans the whole board, so single_match is also
+checked on large boards in debug mode, where a few cells change between searches and only the lines
+through them are rescanned: single cells are written and fallers are dropped, searching after every step.
+The first disagreement is printed and the script exits with status 1.
+'''
+import argparse
+import random
+import sys
+import numpy as np
+import bitboard
+import game_mechanics
+import vector_game_state
+
+_DEFAULT_SIZES = '13x6,24x12,40x20'
+# The chance of each action, in the order NOOP, LEFT, RIGHT, ROTATE, TICK
+_ACTION_WEIGHTS = (0.1, 0.15, 0.15, 0.1, 0.5)
+_WRITES_PER_MATCH_BOARD = 10
+# Boards large enough that a search after a single write, or after a faller step, rescans only the lines near it
+_LARGE_MATCH_SIZES = ((100, 100), (200, 200))
+_MOVES_PER_LARGE_BOARD = 20
+
+
+def check_vector_game_state(boards: int, steps: int, rows: int, columns: int, seed: int, faller_length: int = 3) -> str | None:
+    'Steps a VectorGameState and a GameStepper per board together, returning the first disagreement or None'
+    rng = np.random.default_rng(seed)
+    vector = vector_game_state.VectorGameState(boards, rows, columns, faller_length)
+    hidden_rows = faller_length - 1
+    steppers = [vector_game_state.GameStepper(game_mechanics.GameState(game_mechanics.create_empty_board(rows, columns, hidden_rows),
+                                                                       faller_length))
+                for board in range(boards)]
+    for step in range(steps):
+        actions = rng.choice(len(_ACTION_WEIGHTS), boards, p = _ACTION_WEIGHTS)
+        spawn_scores = rng.random((boards, columns))
+        spawn_jewels = rng.integers(1, len(game_mechanics.JEWEL_COLORS) + 1, (boards, faller_length))
+        rewards, done = vector.step(actions, spawn_scores, spawn_jewels)
+        cells = vector.return_cells()
+        for board, stepper in enumerate(steppers):
+            reward, board_done = stepper.step(int(actions[board]), spawn_scores[board], spawn_jewels[board])
+            if (reward, board_done) != (rewards[board], done[board]):
+                return (f'{rows}x{columns} step {step} board {board}: GameStepper returned {reward}, {board_done} '
+                        f'but VectorGameState returned {rewards[board]}, {done[board]}')
+            encoded = game_mechanics.board_to_bytes(stepper.return_game_state().return_board(), hidden_rows)
+            if encoded[game_mechanics.BOARD_HEADER.size:] != cells[board].tobytes():
+                return f'{rows}x{columns} step {step} board {board}: the boards differ'
+    return None
+
+
+def check_single_match(boards: int, seed: int) -> str | None:
+    'Compares single_match with a brute-force scan on random boards, returning the first disagreement or None'
+    rng = random.Random(seed)
+    symbols = [symbol for symbol in game_mechanics.CELL_SYMBOLS if symbol != '   ']
+    for board_number in range(boards):
+        rows = rng.randint(3, 16)
+        columns = rng.randint(1, 9)
+        # A few colors and plenty of empty cells, so runs of every length and orientation turn up
+        cells = ['   ', '   '] + rng.sample(symbols, 3)
+        board = [[rng.choice(cells) for row in range(rows)] for col in range(columns)]
+        game_state = game_mechanics.GameState(board)
+        for write in range(_WRITES_PER_MATCH_BOARD + 1):
+            expected = brute_force_match(game_state.return_board())
+            found = game_state.single_match()
+            if found != expected:
+                return f'board {board_number} after {write} writes: single_match found {found}, a full scan {expected}'
+            col = rng.randrange(columns)
+            if rng.random() < 0.5:
+                game_state._set_cell(col, rng.randrange(rows), rng.choice(cells))
+            else:
+                game_state._set_column(col, [rng.choice(cells) for row in range(rows)])
+    return None
+
+
+def check_single_match_on_large_boards(boards: int, seed: int) -> str | None:
+    '''
+    Compares single_match with a brute-force scan on large random boards in debug mode, after each of
+    a number of moves that write a single cell or drop a faller, returning the first disagreement or None
+    '''
+    rng = random.Random(seed)
+    jewels = [' R ', ' G ', ' B ']
+    for rows, columns in _LARGE_MATCH_SIZES:
+        for board_number in range(boards):
+            board = game_mechanics.create_empty_board(rows, columns)
+            for column in board:
+                height = rng.randint(0, rows - 1)
+                column[len(column) - height:] = [rng.choice(jewels) for row in range(height)]
+            game_state = game_mechanics.GameState(board, debug = True)
+            for move in range(_MOVES_PER_LARGE_BOARD):
+                try:
+                    _make_random_move(game_state, rng, jewels)
+                    found = game_state.single_match()
+                except AssertionError as error:
+                    return f'{rows}x{columns} board {board_number} move {move + 1}: {error}'
+                expected = brute_force_match(game_state.return_board())
+                if found != expected:
+                    return f'{rows}x{columns} board {board_number} after {move + 1} moves: single_match found {len(found)} positions, a full scan {len(expected)}'
+    return None
+
+
+def _make_random_move(game_state: game_mechanics.GameState, rng: random.Random, jewels: list[str]) -> None:
+    'Writes a random visible cell, or drops a faller into one of the fullest free columns, searching for matches after every step of its fall'
+    board = game_state.return_board()
+    if rng.random() < 0.5 or not game_state.free_columns():
+        game_state._set_cell(rng.randrange(len(board)), rng.randrange(2, len(board[0])), rng.choice(jewels + ['   ']))
+        return
+    # Every step of a long fall costs a full scan in debug mode, so the faller goes into the fullest of a few free columns
+    candidates = rng.sample(game_state.free_columns(), min(5, len(game_state.free_columns())))
+    col = min(candidates, key = lambda col: board[col].count('   '))
+    game_state.put_faller_in_board((col, ['[' + jewel[1] + ']' for jewel in rng.choices(jewels, k = 3)]))
+    while game_state.return_faller() is not None:
+        game_state.single_match()
+        game_state.faller_pass_time()
+
+
+def brute_force_match(board: list[list[str]]) -> list[tuple[int, int]]:
+    'Returns every position in three or more identical jewels in a row on a board, sorted by row and then by column, by trying every cell'
+    columns = len(board)
+    rows = len(board[0])
+    positions = set()
+    for col in range(columns):
+        for row in range(rows):
+            jewel = board[col][row]
+            if jewel == '   ':
+                continue
+            for col_delta, row_delta in bitboard.LINES:
+                # Every line steps down or across, so the run is on the board when its last cell is
+                last_col = col + 2*col_delta
+                last_row = row + 2*row_delta
+                if 0 <= last_col < columns and last_row < rows and board[col + col_delta][row + row_delta] == jewel == board[last_col][last_row]:
+                    positions.update(((col, row), (col + col_delta, row + row_delta), (last_col, last_row)))
+    return sorted(positions, key = lambda position: (position[1], position[0]))
+
+
+def _parse_sizes(text: str) -> list[tuple[int, int]]:
+    'Parses comma-separated ROWSxCOLUMNS board sizes'
+    sizes = []
+    for size in text.split(','):
+        rows, columns = size.lower().split('x')
+        sizes.append((int(rows), int(columns)))
+    return sizes
+
+
+def main(arguments: list[str]) -> int:
+    parser = argparse.ArgumentParser(description = 'Check the fast game engines against slow references')
+    parser.add_argument('--boards', type = int, default = 64, help = 'number of boards VectorGameState steps together')
+    parser.add_argument('--steps', type = int, default = 3000, help = 'number of steps to compare at every size')
+    parser.add_argument('--sizes', default = _DEFAULT_SIZES, help = 'comma-separated ROWSxCOLUMNS board sizes')
+    parser.add_argument('--match-boards', type = int, default = 3000, help = 'number of random boards to check single_match on')
+    parser.add_argument('--large-match-boards', type = int, default = 4,
+                        help = 'number of random boards of each large size to check single_match on as cells change')
+    parser.add_argument('--seed', type = int, default = 0, help = 'seed of the actions, spawn draws and random boards')
+    options = parser.parse_args(arguments)
+
+    failures = []
+    for rows, columns in _parse_sizes(options.sizes):
+        failure = check_vector_game_state(options.boards, options.steps, rows, columns, options.seed)
+        print(f'VectorGameState {rows}x{columns}:', failure or 'ok', flush = True)
+        if failure:
+            failures.append(failure)
+    failure = check_single_match(options.match_boards, options.seed)
+    print('single_match:', failure or 'ok', flush = True)
+    if failure:
+        failures.append(failure)
+    failure = check_single_match_on_large_boards(options.large_match_boards, options.seed)
+    print('single_match on large boards:', failure or 'ok')
+    if failure:
+        failures.append(failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,112 @@
+import collections
+import json
+import time
+
+_PERCENTILES = (50, 95, 99)
+# GameState methods that scan the whole board, or a large part of it
+_GAME_STATE_SCANS = ('single_match', '_still_matches', '_scan_line_runs', 'remove_match', 'shift_down_all_empties', '_create_duplicate_board')
+
+
+class FrameProfiler:
+    '''
+    Records how long each phase of a frame takes, how many frames overrun the frame budget and how
+    often the expensive GameState scans run. Timings are kept for the most recent window of frames,
+    and a report can be appended to a file every dump_interval seconds.
+
+    Nothing is timed unless functions are wrapped with timed() and counted(), so a game that is
+    not given a profiler pays nothing for it
+    '''
+    def __init__(self, frame_rate: int, window: int = 300, dump_path: str = None, dump_interval: float = 10.0):
+        self._budget_ns = 1_000_000_000 // frame_rate
+        self._window = window
+        self._dump_path = dump_path
+        self._dump_interval = dump_interval
+        self._phase_times = {}
+        self._frame_times = collections.deque(maxlen = window)
+        self._scan_calls = collections.Counter()
+        self._frames = 0
+        self._overruns = 0
+        self._frame_start = 0
+        self._last_dump = time.monotonic()
+
+    def timed(self, phase: str, function):
+        'Returns a wrapper around function that records how long every call takes under the given phase name'
+        samples = self._phase_times.setdefault(phase, collections.deque(maxlen = self._window))
+        perf_counter_ns = time.perf_counter_ns
+
+        def timed_function(*args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                samples.append(perf_counter_ns() - start)
+        return timed_function
+
+    def counted(self, name: str, function):
+        'Returns a wrapper around function that counts its calls under the given name'
+        scan_calls = self._scan_calls
+
+        def counted_function(*args, **kwargs):
+            scan_calls[name] += 1
+            return function(*args, **kwargs)
+        return counted_function
+
+    def instrument_game_state(self, game_state) -> None:
+        'Counts the calls made to the expensive scans of a GameState'
+        for name in _GAME_STATE_SCANS:
+            if hasattr(game_state, name):
+                setattr(game_state, name, self.counted(name, getattr(game_state, name)))
+
+    def start_frame(self) -> None:
+        'Marks the start of the work done for a frame'
+        self._frame_start = time.perf_counter_ns()
+
+    def end_frame(self) -> None:
+        'Marks the end of the work done for a frame, and writes a report if one is due'
+        elapsed = time.perf_counter_ns() - self._frame_start
+        self._frame_times.append(elapsed)
+        self._frames += 1
+        if elapsed > self._budget_ns:
+            self._overruns += 1
+        if self._dump_path is not None and time.monotonic() - self._last_dump >= self._dump_interval:
+            self.dump()
+
+    def report(self) -> dict:
+        'Returns the frame counts, the scan call counts and percentiles in milliseconds of the recent frame and phase times'
+        return {
+            'time': time.time(),
+            'frames': self._frames,
+            'overruns': self._overruns,
+            'budget_ms': self._budget_ns / 1e6,
+            'frame_ms': _percentiles(self._frame_times),
+            'phase_ms': {phase: _percentiles(samples) for phase, samples in self._phase_times.items()},
+            'scan_calls': dict(self._scan_calls),
+        }
+
+    def summary_lines(self) -> list[str]:
+        'Returns a few short lines describing the recent frame times, for drawing over the game'
+        report = self.report()
+        lines = [f"frame {_format_percentiles(report['frame_ms'])}",
+                 f"over {report['budget_ms']:.1f}ms: {report['overruns']}/{report['frames']}"]
+        for phase, percentiles in report['phase_ms'].items():
+            lines.append(f'{phase} {_format_percentiles(percentiles)}')
+        return lines
+
+    def dump(self) -> None:
+        'Appends the current report to the dump file as one line of JSON'
+        with open(self._dump_path, 'a') as dump_file:
+            dump_file.write(json.dumps(self.report()) + '\n')
+        self._last_dump = time.monotonic()
+
+
+def _percentiles(samples) -> dict:
+    'Returns the p50, p95 and p99 of a collection of nanosecond samples, in milliseconds'
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+    return {f'p{percentile}': ordered[min(len(ordered) - 1, len(ordered) * percentile // 100)] / 1e6 for percentile in _PERCENTILES}
+
+
+def _format_percentiles(percentiles: dict) -> str:
+    'Formats percentiles in milliseconds as "p50/p95/p99"'
+    return '/'.join(f'{percentiles.get(f"p{percentile}", 0):.2f}' for percentile in _PERCENTILES) + 'ms'
@@ -0,0 +1,53 @@
+import time
+from typing import Callable
+
+
+class FixedStepScheduler:
+    '''
+    Decides when to advance a simulation that runs a fixed number of steps per second of wall-clock
+    time, and when to render it. Elapsed time goes into an accumulator and is paid out one step at
+    a time, so a late update runs the steps it missed instead of slowing the game down. After a long
+    stall, at most max_catch_up steps are run and the rest of the backlog is dropped.
+
+    Rendering runs at most render_rate times per second, or after every update that ran a step
+    when render_rate is None. Raises ValueError unless both rates are greater than 0
+    '''
+    def __init__(self, step_rate: float, render_rate: float = None, max_catch_up: int = 5, clock: Callable[[], float] = time.perf_counter):
+        if not step_rate > 0:
+            raise ValueError(f'step rate must be greater than 0, not {step_rate}')
+        if render_rate is not None and not render_rate > 0:
+            raise ValueError(f'render rate must be greater than 0, not {render_rate}')
+        self._step_seconds = 1 / step_rate
+        self._render_seconds = 0 if render_rate is None else 1 / render_rate
+        self._max_catch_up = max_catch_up
+        self._clock = clock
+        self._last_time = clock()
+        self._accumulated = 0.0
+        self._last_render = float('-inf')
+
+    def steps_due(self) -> int:
+        'Returns how many simulation steps are due since the last call, taking them out of the accumulator'
+        now = self._clock()
+        self._accumulated += now - self._last_time
+        self._last_time = now
+        steps = int(self._accumulated / self._step_seconds)
+        self._accumulated -= steps * self._step_seconds
+        if steps > self._max_catch_up:
+            steps = self._max_catch_up
+        return steps
+
+    def render_due(self) -> bool:
+        'Returns True, and records a render, if enough time has passed since the last render'
+        now = self._clock()
+        if now - self._last_render < self._render_seconds:
+            return False
+        self._last_render = now
+        return True
+
+    def seconds_until_step(self) -> float:
+        'Returns how long until the next simulation step is due'
+        return max(0.0, self._step_seconds - self._accumulated - (self._clock() - self._last_time))
+
+    def seconds_until_render(self) -> float:
+        'Returns how long until a render is allowed again'
+        return max(0.0, self._render_seconds - (self._clock() - self._last_render))
@@ -0,0 +1,264 @@
+'''
+Records games to compact binary logs, and replays them.
+
+A log starts with a header giving the board size, faller length, keyframe interval and, if known,
+the seed of the game. Records follow, each a kind, the frame (tick) it happened in and the length
+of its payload:
+
+    FALLER    the column and colors of a faller put into the board
+    INPUT     a faller command ("left", "right" or "reverse") as a one byte code
+    KEYFRAME  the whole game encoded by ColumnsGame.to_bytes, at the start of the frame
+    END       the number of frames played and whether the game had ended, lost or quit
+
+The log is only ever appended to, and a keyframe is written every keyframe_interval frames, and
+flushed to disk with everything before it. GameLog maps a log into memory, indexes its keyframes,
+and replays from the nearest keyframe to any frame, taking fallers and commands from the log.
+scan_logs reads the statistics of many logs without loading them into memory.
+
+    python game_log.py LOG... [--replay FRAME]
+'''
+import argparse
+import bisect
+import mmap
+import os
+import struct
+import sys
+from typing import Callable, Iterable, Iterator, NamedTuple
+import columns_game
+
+FALLER = 1
+INPUT = 2
+KEYFRAME = 3
+END = 4
+_MAGIC = b'CLOG'
+_VERSION = 1
+# The magic bytes, version, visible rows, columns, faller length, keyframe interval, whether there is a seed, and the seed
+_LOG_HEADER = struct.Struct('<4sBHHBI?q')
+_RECORD_HEADER = struct.Struct('<BII')
+_FALLER_COLUMN = struct.Struct('<H')
+_END = struct.Struct('<I?')
+_COMMANDS = ('left', 'right', 'reverse')
+_COMMAND_CODES = {command: code for code, command in enumerate(_COMMANDS)}
+
+
+class LogHeader(NamedTuple):
+    'The settings of a logged game'
+    rows: int
+    columns: int
+    faller_length: int
+    keyframe_interval: int
+    seed: int | None
+
+
+class LogStats(NamedTuple):
+    '''
+    What a log holds. frames is the number of frames played, taken from the last record if the log
+    has no END record, as when the game crashed; game_over is None then
+    '''
+    path: str
+    frames: int
+    fallers: int
+    inputs: int
+    keyframes: int
+    game_over: bool | None
+
+
+class GameRecorder:
+    '''
+    Appends the fallers, commands and periodic keyframes of a game to a log file. Pass it to
+    ColumnsGame, and close it, or use it as a context manager, once the game ends
+    '''
+    def __init__(self, path: str, rows: int, columns: int, faller_length: int, seed: int = None, keyframe_interval: int = 300):
+        self._file = open(path, 'wb')
+        self._keyframe_interval = keyframe_interval
+        self._frames = 0
+        self._game_over = False
+        self._file.write(_LOG_HEADER.pack(_MAGIC, _VERSION, rows, columns, faller_length, keyframe_interval,
+                                          seed is not None, 0 if seed is None else seed))
+
+    def __enter__(self) -> 'GameRecorder':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def record_faller(self, frame: int, faller: tuple[int, list[str]]) -> None:
+        'Records a faller put into the board during a frame'
+        column, jewels = faller
+        self._write(FALLER, frame, _FALLER_COLUMN.pack(column) + ''.join(jewel[1] for jewel in jewels).encode('ascii'))
+
+    def record_input(self, frame: int, command: str) -> None:
+        'Records a faller command applied during a frame'
+        self._write(INPUT, frame, bytes((_COMMAND_CODES[command],)))
+
+    def record_keyframe(self, frame: int, data: bytes) -> None:
+        'Records the state of the game, encoded by ColumnsGame.to_bytes, at the start of a frame, and flushes the log'
+        self._write(KEYFRAME, frame, data)
+        self._file.flush()
+
+    def end_frame(self, frames: int, active: bool, encode_game: Callable[[], bytes]) -> None:
+        'Notes that a number of frames have been played, recording a keyframe from encode_game when one is due'
+        self._frames = frames
+        self._game_over = not active
+        if active and frames % self._keyframe_interval == 0:
+            self.record_keyframe(frames, encode_game())
+
+    def close(self) -> None:
+        'Records how many frames were played and whether the game was over, and closes the log'
+        if not self._file.closed:
+            self._write(END, self._frames, _END.pack(self._frames, self._game_over))
+            self._file.close()
+
+    def _write(self, kind: int, frame: int, payload: bytes) -> None:
+        'Appends a record to the log'
+        self._file.write(_RECORD_HEADER.pack(kind, frame, len(payload)) + payload)
+
+
+class GameLog:
+    '''
+    A game log mapped into memory. Opening one reads the header and the header of every record, to
+    index the keyframes, without reading the payloads. Close it, or use it as a context manager, to unmap it
+    '''
+    def __init__(self, path: str):
+        self._path = path
+        with open(path, 'rb') as log:
+            self._map = mmap.mmap(log.fileno(), 0, access = mmap.ACCESS_READ)
+        self.header = _read_header(self._map, path)
+        # The frame of every keyframe, and where its payload is
+        self._keyframe_frames = []
+        self._keyframe_payloads = []
+        for kind, frame, offset, length in _records(self._map):
+            if kind == KEYFRAME:
+                self._keyframe_frames.append(frame)
+                self._keyframe_payloads.append((offset, length))
+
+    def __enter__(self) -> 'GameLog':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        'Unmaps the log'
+        self._map.close()
+
+    def keyframes(self) -> list[int]:
+        'Returns the frames that have a keyframe, in order'
+        return list(self._keyframe_frames)
+
+    def stats(self) -> LogStats:
+        'Returns what the log holds'
+        return _scan(self._map, self._path)
+
+    def replay(self, frame: int) -> 'columns_game.ColumnsGame':
+        '''
+        Returns the game as it was after the given number of frames, restored from the last keyframe at
+        or before it and played on with the logged fallers and commands. While the log is open, the game
+        can be played on from there with the rest of the logged fallers
+        '''
+        index = bisect.bisect_right(self._keyframe_frames, frame) - 1
+        if index < 0:
+            raise ValueError(f'{self._path} has no keyframe at or before frame {frame}')
+        keyframe_frame = self._keyframe_frames[index]
+        start, length = self._keyframe_payloads[index]
+        commands = {}
+        for kind, record_frame, record_offset, record_length in _records(self._map, start + length):
+            if record_frame >= frame:
+                break
+            if kind == INPUT:
+                commands.setdefault(record_frame, []).append(_COMMANDS[self._map[record_offset]])
+        game = columns_game.ColumnsGame.from_bytes(self._map[start:start + length], self._fallers(start + length))
+        for played in range(keyframe_frame, frame):
+            if not game.advance_frame(lambda played: commands.get(played, ()), played):
+                break
+        return game
+
+    def _fallers(self, offset: int) -> Iterator[tuple[int, list[str]]]:
+        'Yields every faller logged from offset on'
+        for kind, frame, record_offset, length in _records(self._map, offset):
+            if kind == FALLER:
+                yield _decode_faller(self._map[record_offset:record_offset + length])
+
+
+def scan_logs(paths: Iterable[str]) -> Iterator[LogStats]:
+    'Yields the statistics of every log, mapping one log at a time into memory and reading only its record headers'
+    for path in paths:
+        with open(path, 'rb') as log:
+            if os.fstat(log.fileno()).st_size == 0:
+                continue
+            with mmap.mmap(log.fileno(), 0, access = mmap.ACCESS_READ) as mapped:
+                _read_header(mapped, path)
+                yield _scan(mapped, path)
+
+
+def _read_header(mapped: mmap.mmap, path: str) -> LogHeader:
+    'Returns the header of a mapped log, raising ValueError if it is not a game log'
+    if len(mapped) < _LOG_HEADER.size:
+        raise ValueError(f'{path} is not a game log')
+    magic, version, rows, columns, faller_length, keyframe_interval, has_seed, seed = _LOG_HEADER.unpack_from(mapped)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError(f'{path} is not a version {_VERSION} game log')
+    return LogHeader(rows, columns, faller_length, keyframe_interval, seed if has_seed else None)
+
+
+def _records(mapped: mmap.mmap, offset: int = _LOG_HEADER.size) -> Iterator[tuple[int, int, int, int]]:
+    'Yields the kind, frame, payload offset and payload length of every whole record from offset on, stopping at a truncated one'
+    end = len(mapped)
+    while offset + _RECORD_HEADER.size <= end:
+        kind, frame, length = _RECORD_HEADER.unpack_from(mapped, offset)
+        offset += _RECORD_HEADER.size
+        if offset + length > end:
+            return
+        yield kind, frame, offset, length
+        offset += length
+
+
+def _scan(mapped: mmap.mmap, path: str) -> LogStats:
+    'Counts the records of a mapped log'
+    frames = 0
+    counts = {FALLER: 0, INPUT: 0, KEYFRAME: 0}
+    game_over = None
+    for kind, frame, offset, length in _records(mapped):
+        frames = max(frames, frame)
+        if kind == END:
+            frames, game_over = _END.unpack_from(mapped, offset)
+        else:
+            counts[kind] += 1
+    return LogStats(path, frames, counts[FALLER], counts[INPUT], counts[KEYFRAME], game_over)
+
+
+def _decode_faller(payload: bytes) -> tuple[int, list[str]]:
+    'Decodes the payload of a FALLER record'
+    column, = _FALLER_COLUMN.unpack_from(payload)
+    return (column, ['[' + color + ']' for color in payload[_FALLER_COLUMN.size:].decode('ascii')])
+
+
+def main(arguments: list[str]) -> int:
+    parser = argparse.ArgumentParser(description = 'Summarize or replay Columns game logs')
+    parser.add_argument('logs', nargs = '+', metavar = 'LOG', help = 'game logs written with --record')
+    parser.add_argument('--replay', type = int, metavar = 'FRAME', help = 'print the board of each log after FRAME frames')
+    options = parser.parse_args(arguments)
+
+    if options.replay is not None:
+        for path in options.logs:
+            with GameLog(path) as log:
+                board = log.replay(options.replay).return_game_state().return_board()
+                hidden_rows = log.header.faller_length - 1
+            print(path)
+            for row in list(zip(*board))[hidden_rows:]:
+                print('|' + ''.join(row) + '|')
+        return 0
+    games = frames = fallers = 0
+    for stats in scan_logs(options.logs):
+        print(f'{stats.path}: {stats.frames} frames, {stats.fallers} fallers, {stats.inputs} inputs, {stats.keyframes} keyframes, '
+              f'{"ended" if stats.game_over else "unfinished" if stats.game_over is None else "stopped"}')
+        games += 1
+        frames += stats.frames
+        fallers += stats.fallers
+    if games:
+        print(f'{games} logs, {frames / games:.0f} frames and {fallers / games:.1f} fallers per game')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
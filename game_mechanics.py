@@ -1,11 +1,179 @@
+import bisect
+import bitboard
+import collections
+import itertools
+import random
+import struct
+import transposition_cache
+from typing import Iterable, NamedTuple
+
+# A full scan through the bitboards costs about as much as rescanning the lines through one changed
+# cell, plus that again for every _CELLS_PER_RESCAN cells on the board
+_CELLS_PER_RESCAN = 6000
+# Header of the to_bytes encoding: the number of columns, of rows and of hidden rows
+BOARD_HEADER = struct.Struct('<HHB')
+_HASH_MASK = (1 << 64) - 1
+
+
+class CascadeStep(NamedTuple):
+    'One link of a chain reaction: the cells cleared at once, and how deep in the chain they were'
+    chain: int
+    cleared: int
+    positions: list[tuple[int, int]]
+
+
+class _SettledBoard(NamedTuple):
+    '''
+    What resolve_cascades caches for a board: its steps, with their positions in tuples, every changed
+    column with its count of empty visible cells, and the hash and counts of the whole settled board
+    '''
+    steps: tuple[CascadeStep, ...]
+    columns: tuple[tuple[int, list[str], int], ...]
+    zobrist_hash: int
+    hidden_jewels: int
+    matched_cells: int
+
+
+class GameSnapshot(NamedTuple):
+    '''
+    The state of a GameState at one moment, taken by snapshot() and put back by restore().
+    The columns are shared with the GameState they came from and must not be modified
+    '''
+    board: tuple[list[str], ...]
+    hidden_rows: int
+    faller_column: int | None
+    faller_top: int
+    faller_length: int
+    faller_landed: bool
+    matched_cells: int
+    line_runs: tuple[int, ...]
+    bitboards: bitboard.Bitboards
+    dirty_cells: frozenset
+    zobrist_hash: int | None
+    empty_cells: tuple[int, ...]
+    hidden_jewels: int
+
+
 class GameState:
-    def __init__(self, board: list[list[str]]):
-        self._board = board
+    def __init__(self, board: list[list[str]], faller_length: int = 3, debug: bool = False,
+                 cache: transposition_cache.TranspositionCache = None):
+        '''
+        Copies a game board whose top faller_length - 1 rows are hidden. When debug is True,
+        every incremental match search and cached result is checked against a full scan of the
+        board and an AssertionError is raised if they disagree. When a cache is given, match
+        positions and settled boards are looked up in it by the board's Zobrist hash, which is
+        then updated on every cell write. Raises ValueError unless the board has a column and a visible row
+        '''
+        if faller_length < 1:
+            raise ValueError(f'faller length must be at least 1, not {faller_length}')
+        if not board or len(board[0]) < faller_length:
+            raise ValueError(f'a game board needs at least one column and one visible row below its {faller_length - 1} hidden rows')
+        self._board = [column[:] for column in board]
+        self._hidden_rows = faller_length - 1
+        self._debug = debug
+        self._cache = cache
+        self._position_keys = _position_keys(len(board), len(board[0]))
+        self._hash = None if cache is None else self._full_hash()
+        # Columns shared with a snapshot or clone, which are copied before they are first written to
+        self._shared_columns = set()
+        # One bitboard per jewel kept up to date by every write, the cells in a run of three or more
+        # along each orientation in bitboard.LINES, and the cells written since those were last brought up to date
+        self._bitboards = bitboard.Bitboards(self._board)
+        self._line_runs = self._scan_line_runs()
+        self._dirty_cells = set()
+        self._rescan_limit = 1 + len(board) * len(board[0]) // _CELLS_PER_RESCAN
+        self._matched_cells = 0
+        # The empty cells in the visible rows of each column, the columns that have any, in order,
+        # and the jewels in the hidden rows, all kept up to date by the writes to the board
+        self._empty_cells = [column[self._hidden_rows:].count('   ') for column in self._board]
+        self._free_columns = [col for col, empty in enumerate(self._empty_cells) if empty]
+        self._hidden_jewels = sum(self._hidden_rows - column[:self._hidden_rows].count('   ') for column in self._board)
+        self._faller_column = None
+        self._faller_top = 0
+        self._faller_length = 0
+        self._faller_landed = False
+        self._find_faller_and_matches()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, cache: transposition_cache.TranspositionCache = None) -> 'GameState':
+        'Creates a GameState from the encoding returned by to_bytes()'
+        board, hidden_rows = board_from_bytes(data)
+        if cache is None:
+            return cls(board, hidden_rows + 1)
+        return cls(board, hidden_rows + 1, cache = cache)
+
+    def zobrist_hash(self) -> int:
+        'Returns a 64-bit hash of the board and its size, which is kept up to date when there is a cache and computed from the whole board otherwise'
+        if self._hash is None:
+            return self._full_hash()
+        return self._hash
 
     def return_board(self) -> list[list[str]]:
-        'Returns the current game board'
+        'Returns the current game board, which must not be modified'
         return self._board
 
+    def return_faller(self) -> tuple[int, list[str]] | None:
+        'Returns the column and the jewels, top first, of the faller, or None when there is no faller'
+        if self._faller_column is None:
+            return None
+        return (self._faller_column, self._board[self._faller_column][self._faller_top:self._faller_top + self._faller_length])
+
+    def snapshot(self) -> GameSnapshot:
+        'Returns the current state of the game. Taking one costs O(columns), as the columns are shared until they are next written to'
+        self._shared_columns.update(range(self._board_columns()))
+        return GameSnapshot(tuple(self._board), self._hidden_rows, self._faller_column, self._faller_top, self._faller_length,
+                            self._faller_landed, self._matched_cells, tuple(self._line_runs), self._bitboards.copy(),
+                            frozenset(self._dirty_cells), self._hash, tuple(self._empty_cells), self._hidden_jewels)
+
+    def restore(self, snapshot: GameSnapshot) -> None:
+        'Puts the game back into the state of a snapshot, which can be restored again later'
+        self._board = list(snapshot.board)
+        self._shared_columns = set(range(len(self._board)))
+        self._hidden_rows = snapshot.hidden_rows
+        self._faller_column = snapshot.faller_column
+        self._faller_top = snapshot.faller_top
+        self._faller_length = snapshot.faller_length
+        self._faller_landed = snapshot.faller_landed
+        self._matched_cells = snapshot.matched_cells
+        self._line_runs = list(snapshot.line_runs)
+        self._bitboards = snapshot.bitboards.copy()
+        self._dirty_cells = set(snapshot.dirty_cells)
+        self._hash = snapshot.zobrist_hash
+        self._empty_cells = list(snapshot.empty_cells)
+        self._free_columns = [col for col, empty in enumerate(self._empty_cells) if empty]
+        self._hidden_jewels = snapshot.hidden_jewels
+        if self._hash is None and self._cache is not None:
+            self._hash = self._full_hash()
+
+    def clone(self) -> 'GameState':
+        'Returns an independent copy of the game, which only copies a column once either game writes to it'
+        clone = object.__new__(type(self))
+        self._shared_columns = set(range(self._board_columns()))
+        clone._board = self._board[:]
+        clone._hidden_rows = self._hidden_rows
+        clone._debug = self._debug
+        clone._cache = self._cache
+        clone._position_keys = self._position_keys
+        clone._hash = self._hash
+        clone._shared_columns = self._shared_columns.copy()
+        clone._bitboards = self._bitboards.copy()
+        clone._line_runs = self._line_runs[:]
+        clone._dirty_cells = self._dirty_cells.copy()
+        clone._rescan_limit = self._rescan_limit
+        clone._matched_cells = self._matched_cells
+        clone._empty_cells = self._empty_cells[:]
+        clone._free_columns = self._free_columns[:]
+        clone._hidden_jewels = self._hidden_jewels
+        clone._faller_column = self._faller_column
+        clone._faller_top = self._faller_top
+        clone._faller_length = self._faller_length
+        clone._faller_landed = self._faller_landed
+        return clone
+
+    def to_bytes(self) -> bytes:
+        'Encodes the game board in one byte per cell, column by column, after a short header giving its size'
+        return board_to_bytes(self._board, self._hidden_rows)
+
     def create_faller(self, specifications: str) -> tuple[int, list[str]]:
         'Creates a faller based on a string of text as a tuple containing the column as an int and contents of the faller as a list'
         column = int(specifications[2]) - 1
@@ -19,252 +187,400 @@ class GameState:
         column = faller[0]
         content = faller[1]
         for i in range(len(content)):
-            self.return_board()[column][i] = content[i]
-        if self._should_land(self.return_board()[column]):
+            self._set_cell(column, i, content[i])
+        self._faller_column = column
+        self._faller_top = 0
+        self._faller_length = len(content)
+        self._faller_landed = False
+        if self._should_land():
             self._land()
 
-    def faller_pass_time(self, column: int, left_off: int):
+    def faller_pass_time(self):
         'Handles the passage of time of a faller as it drops into the game board until freezing. If the faller should land, it does'
         if self.faller_in_landed():
             self._freeze()
             return
-        self._board[column] = self._shift_column_down_from_index(self.return_board()[column], left_off)
-        if self._should_land(self.return_board()[column]):
+        if self._faller_column is None:
+            return
+        column = self._board[self._faller_column]
+        for row in range(self._faller_top + self._faller_length, self._faller_top, -1):
+            self._set_cell(self._faller_column, row, column[row-1])
+        self._set_cell(self._faller_column, self._faller_top, '   ')
+        self._faller_top += 1
+        if self._should_land():
             self._land()
 
-    def faller_move_delta(self, column: int, delta: int) -> int:
+    def faller_move_delta(self, delta: int) -> int | None:
         '''
         Moves a faller in delta direction, with +1 representing right and -1 representing to left.
         If the faller should land , it lands. If movement causes the faller to unland, it unlands
-        Returns the column that the faller is in after movement
+        Returns the column that the faller is in after movement, or None when there is no faller
         '''
-        if self._can_move_faller_delta(delta):
-            column += delta
+        if self._faller_column is None:
+            return None
         self._move_faller_delta(delta)
-        if self._should_land(self.return_board()[column]):
+        if self._should_land():
             self._land()
         else:
             self._unland()
-        return column
+        return self._faller_column
 
-    def faller_reverse(self, column: int, left_off: int):
-        'Reverses a faller'
-        temp = self.return_board()[column][left_off-1]
-        self.return_board()[column][left_off-1] = self.return_board()[column][left_off-2]
-        self.return_board()[column][left_off-2] = self.return_board()[column][left_off-3]
-        self.return_board()[column][left_off-3] = temp
+    def faller_reverse(self):
+        'Reverses a faller, moving the bottom jewel to the top and every other jewel down by one'
+        if self._faller_column is None:
+            return
+        column = self._board[self._faller_column]
+        bottom = self._faller_top + self._faller_length - 1
+        temp = column[bottom]
+        for row in range(bottom, self._faller_top, -1):
+            self._set_cell(self._faller_column, row, column[row-1])
+        self._set_cell(self._faller_column, self._faller_top, temp)
 
     def check_if_dead(self) -> bool:
-        'Checks if it should be GAME OVER at a frozen state'
-        for col in self.return_board():
-            if col[0] == '   ' and col[1] == '   ':
-                pass
-            else:
-                return True
-        return False
+        'Checks if it should be GAME OVER at a frozen state, which is when a jewel is in the hidden rows'
+        return self._hidden_jewels > 0
 
 
     def faller_in_landed(self) -> bool:
         'Determines if a faller is in landed position'
-        for col in range(len(self._board)):
-            for row in range(len(self._board[col])):
-                if self._board[col][row].startswith('|'):
-                    return True
-        return False
+        return self._faller_column is not None and self._faller_landed
 
     def faller_in_frozen(self) -> bool:
         'Determines if a faller is in frozen position'
-        for col in range(len(self._board)):
-            for row in range(len(self._board[col])):
-                if self._board[col][row].startswith(' '):
-                    pass
-                else:
-                    return False
-        return True
+        return self._faller_column is None and self._matched_cells == 0
 
     def faller_in_matching(self) -> bool:
-        for col in range(len(self._board)):
-            for row in range(len(self._board[col])):
-                if self._board[col][row].startswith('*'):
-                    return True
-        return False
+        return self._matched_cells > 0
 
     def single_match(self) -> list[tuple[int,int]]:
-        'Determines the index positions of all jewels matching sequence'
-        positions = []
-        for col in range(self._board_columns()):
-            for row in range(self._board_rows()):
-                if self._matching_sequence_begins_at(col, row) and (col,row) not in positions:
-                    coldelta = self._matching_sequence_begins_at(col, row)[1]
-                    rowdelta = self._matching_sequence_begins_at(col, row)[2]
-                    temp_positions = self._get_positions_to_be_removed(col, row, coldelta, rowdelta)
-                    temp_positions.insert(0,(col,row))
-                    positions.extend(temp_positions)
-        positions = self._remove_duplciates_in_positions(positions)
-        positions.sort(key = lambda x: x[1])
+        'Determines the index positions of all jewels matching sequence, sorted by row and then by column'
+        if self._cache is not None:
+            cached = self._cache.get('match', self._hash)
+            if cached is not None and not self._debug:
+                return list(cached)
+        positions = self._bitboards.positions(self._run_cells())
+        if self._cache is not None:
+            if cached is not None and list(cached) != positions:
+                raise AssertionError('Cached match positions disagree with a full scan of the board')
+            self._cache.put('match', self._hash, tuple(positions))
         return positions
 
     def remove_match(self, positions) -> None:
-        'Removes index positions in a list from the game board'
-        for position in positions:
-            self._board[position[0]] = self._shift_column_down_from_index(self._board[position[0]], position[1])
+        'Removes index positions in a list from the game board, compacting each affected column once'
+        removed_rows = collections.defaultdict(list)
+        for col, row in positions:
+            removed_rows[col].append(row)
+        for col, rows in removed_rows.items():
+            removed = bytearray(max(rows) + 1)
+            for row in rows:
+                removed[row] = 1
+            start = self._bitboards.remove_from_column(col, removed)
+            self._record_column(col, self._bitboards.column(col), start, len(removed))
+
+    def resolve_cascades(self) -> list[CascadeStep]:
+        '''
+        Clears every match at once and lets the columns fall, repeating until no matches are left.
+        Returns one CascadeStep per round of clearing, in order, so the chain can be animated or scored.
+        Meant to be called once the faller has frozen. With a cache, a board that was settled before
+        gets its changed columns, hash and counts back from the cache without searching for matches
+        '''
+        if self._cache is not None:
+            start_hash = self._hash
+            settled = self._cache.get('settle', start_hash)
+            if settled is not None and not self._debug:
+                self._apply_settled_board(settled)
+                return [step._replace(positions = list(step.positions)) for step in settled.steps]
+        steps = self._cascade()
+        if self._cache is not None:
+            changed = sorted({col for step in steps for col, row in step.positions})
+            self._shared_columns.update(changed)
+            # The cached steps hold their positions in tuples, so callers cannot change them through the lists they are given
+            result = _SettledBoard(tuple(step._replace(positions = tuple(step.positions)) for step in steps),
+                                   tuple((col, self._board[col], self._empty_cells[col]) for col in changed),
+                                   self._hash, self._hidden_jewels, self._matched_cells)
+            if settled is not None and settled != result:
+                raise AssertionError('Cached settled board disagrees with settling the board')
+            self._cache.put('settle', start_hash, result)
+        return steps
+
+    def _apply_settled_board(self, settled: _SettledBoard) -> None:
+        '''
+        Puts the cached settled columns in the game board, sharing them with the cache, and takes the
+        hash and counts of the settled board from it instead of going over the cells that changed.
+        A settled board has no runs, so no cells are left to rescan
+        '''
+        for col, column, empty in settled.columns:
+            self._bitboards.replace_column(col, 0, column)
+            self._board[col] = column
+            self._shared_columns.add(col)
+            self._set_empty_cells(col, empty)
+        self._hash = settled.zobrist_hash
+        self._hidden_jewels = settled.hidden_jewels
+        self._matched_cells = settled.matched_cells
+        self._line_runs = [0] * len(bitboard.LINES)
+        self._dirty_cells.clear()
 
     def add_signal(self, positions) -> None:
         'Adds the matching to signal to specified positions contained within a list'
         for position in positions:
-            self.return_board()[position[0]][position[1]] = '*' + self.return_board()[position[0]][position[1]][1] + '*'
+            self._set_cell(position[0], position[1], '*' + self.return_board()[position[0]][position[1]][1] + '*')
 
     def _still_matches(self) -> bool:
         'Determines if there are still possible matches left on the board'
-        for col in range(self._board_columns()):
-            for row in range(self._board_rows()):
-                if self._matching_sequence_begins_at(col, row):
-                    return True
-        return False
+        if self._cache is not None and not self._debug:
+            cached = self._cache.get('match', self._hash)
+            if cached is not None:
+                return bool(cached)
+        self._update_line_runs()
+        return any(self._line_runs)
 
     def shift_down_all_empties(self):
-        'Shifts down all empty positions in the game board'
+        'Shifts down all empty positions in the game board, compacting each column only above its lowest gap'
         for col in range(self._board_columns()):
-            self._board[col] = self._shift_down_empties(self._board[col])   
+            start, stop = self._bitboards.drop_column(col)
+            if start < stop:
+                self._record_column(col, self._bitboards.column(col), start, stop)
+        if self._faller_column is not None:
+            column = self._board[self._faller_column]
+            while column[self._faller_top][0] not in '[|':
+                self._faller_top += 1
 
     def column_is_full(self, column: int) -> bool:
         'Determines if a column is full of frozen pieces'
-        for i in range(2, len(self._board[column])):
-            if self._board[column][i] == '   ':
-                return False
-        return True
+        return self._empty_cells[column] == 0
 
-    def _shift_column_down_from_index(self, col: list[str], index: int) -> list[str]:
-        'shifts down a column based on a particular index.'
-        shifted = []
-        for i in range(len(col)):
-            if i != index:
-                shifted.append(col[i])
-        while len(shifted) != len(col):
-            shifted.insert(0,'   ')
-        return shifted    
-
-    def _should_land(self, column: list[str]) -> bool:
-        'Determines if a faller should land'
-        if '   ' not in column:
-            return True
-        for i in range(1, len(column)):
-            if column[i] == '   ':
-                for j in range(i, -1, -1):
-                    if column[j] != '   ':
-                        return False
-        return True
+    def free_columns(self) -> list[int]:
+        'Returns the columns that are not full, in order. The list is kept up to date as the board changes and must not be modified'
+        return self._free_columns
+
+    def _cascade(self) -> list[CascadeStep]:
+        '''
+        Clears every match at once and lets the columns fall until no matches are left, returning a
+        CascadeStep per round. The rounds run on the bitboards alone, scanning them whole each time,
+        and each changed column of the board is written once at the end
+        '''
+        steps = []
+        # The rows of each column that changed in any round so far
+        spans = {}
+        cells = self._run_cells()
+        while cells:
+            positions = self._bitboards.positions(cells)
+            for col, start, stop in self._bitboards.remove_cells(cells):
+                old_start, old_stop = spans.get(col, (start, stop))
+                spans[col] = (min(start, old_start), max(stop, old_stop))
+            steps.append(CascadeStep(len(steps) + 1, len(positions), positions))
+            self._line_runs = self._scan_line_runs()
+            cells = self._run_cells()
+        for col, (start, stop) in spans.items():
+            self._record_column(col, self._bitboards.column(col), start, stop)
+        # The line runs are those of the settled board already
+        self._dirty_cells.clear()
+        return steps
+
+    def _should_land(self) -> bool:
+        'Determines if the faller should land, which is when it rests on a jewel or on the bottom of the board'
+        below = self._faller_top + self._faller_length
+        return below == self._board_rows() or self._board[self._faller_column][below] != '   '
 
     def _can_move_faller_delta(self, delta: int) -> bool:
         'Determines if a faller can move in a direction indicated by delta, with 1 representing right and -1 representing left'
-        can_move_delta = True
-        for col in range(len(self._board)):
-            for row in range(len(self._board[col])):
-                if self._board[col][row].startswith('[') or self._board[col][row].startswith('|'):
-                    if self._is_valid_column_number(col+delta) and self._board[col+delta][row] == '   ':
-                        pass
-                    else:
-                        can_move_delta = False
-                        break
-        return can_move_delta
-
-    def _move_faller_delta(self, delta: int) -> list[list[str]]:
+        target = self._faller_column + delta
+        if not self._is_valid_column_number(target):
+            return False
+        for row in range(self._faller_top, self._faller_top + self._faller_length):
+            if self._board[target][row] != '   ':
+                return False
+        return True
+
+    def _move_faller_delta(self, delta: int) -> None:
         'Moves a faller in delta direction, with 1 representing right and -1 representing left'
-        moved = False
         if self._can_move_faller_delta(delta):
-            for col in range(len(self._board)):
-                for row in range(len(self._board[col])):
-                    if self._board[col][row].startswith('[') or self._board[col][row].startswith('|'):
-                        self._board[col+delta][row] = self._board[col][row]
-                        self._board[col][row] = '   '
-                        moved = True
-                if moved == True:
-                    break
-                    
+            for row in range(self._faller_top, self._faller_top + self._faller_length):
+                self._set_cell(self._faller_column + delta, row, self._board[self._faller_column][row])
+                self._set_cell(self._faller_column, row, '   ')
+            self._faller_column += delta
+
     def _land(self):
         'lands a faller'
-        for col in range(len(self._board)):
-            for row in range(len(self._board[col])):
-                if self._board[col][row].startswith('['):
-                    self._board[col][row] = '|' + self._board[col][row][1] + '|'
-    
+        for row in range(self._faller_top, self._faller_top + self._faller_length):
+            self._set_cell(self._faller_column, row, '|' + self._board[self._faller_column][row][1] + '|')
+        self._faller_landed = True
+
     def _unland(self):
         'unlands a faller'
-        for col in range(len(self._board)):
-            for row in range(len(self._board[col])):
-                if self._board[col][row].startswith('|'):
-                    self._board[col][row] = '[' + self._board[col][row][1] + ']'
+        for row in range(self._faller_top, self._faller_top + self._faller_length):
+            self._set_cell(self._faller_column, row, '[' + self._board[self._faller_column][row][1] + ']')
+        self._faller_landed = False
 
     def _freeze(self):
         'freezes a faller'
-        for col in range(len(self._board)):
-            for row in range(len(self._board[col])):
-                if self._board[col][row].startswith('|'):
-                    self._board[col][row] = ' ' + self._board[col][row][1] + ' '
+        for row in range(self._faller_top, self._faller_top + self._faller_length):
+            self._set_cell(self._faller_column, row, ' ' + self._board[self._faller_column][row][1] + ' ')
+        self._faller_column = None
+        self._faller_landed = False
 
     def _create_duplicate_board(self) -> list[list[str]]:
         'returns a duplicate of the current game board'
-        duplicate_board = []
-        for col in range(len(self._board)):
-            duplicate_board.append([])
-            for row in range(len(self._board[col])):
-                duplicate_board[col].append(self._board[col][row])
-        return duplicate_board
-
-    def _get_positions_to_be_removed(self, col: int, row: int, coldelta: int, rowdelta: int) -> list[tuple[int, int]]:
-        'Determines what positions should be removed in a game board after matching occurs'
-        positions = []
-        for i in range(1, max(self._board_columns(), self._board_rows())):
-            if not self._is_valid_column_number(col + coldelta * i) \
-                    or not self._is_valid_row_number(row + rowdelta * i) \
-                    or self._board[col + coldelta *i][row + rowdelta * i] != self._board[col][row]:
-                break
-            else:
-                positions.append((col + coldelta * i, row + rowdelta * i))
-        return positions
-
-    def _shift_down_empties(self, col: list[str]) -> list[str]:
-        'shifts down the empty spaces in a column'
-        shifted = []
-        for char in col:
-            if char != '   ':
-                shifted.append(char)
-        while len(shifted) != len(col):
-            shifted.insert(0,'   ')
-        return shifted
-
-    def _matching_sequence_begins_at(self, col: int, row: int) -> tuple[bool, int, int]:
-        'Returns the result of possible matches in all directions'
-        return self._three_or_more_in_a_row(col, row, 0, 1) \
-                or self._three_or_more_in_a_row(col, row, 1, 1) \
-                or self._three_or_more_in_a_row(col, row, 1, 0) \
-                or self._three_or_more_in_a_row(col, row, 1, -1) \
-                or self._three_or_more_in_a_row(col, row, 0, -1) \
-                or self._three_or_more_in_a_row(col, row, -1, -1) \
-                or self._three_or_more_in_a_row(col, row, -1, 0) \
-                or self._three_or_more_in_a_row(col, row, -1, 1)
-
-    def _three_or_more_in_a_row(self, col: int, row: int, coldelta: int, rowdelta: int) -> tuple[bool, int, int]:
-        'Determines if there is a matching sequence in the current game board, and returns the direction in which the match occurs'
-        start_cell = self._board[col][row]
-
-        if start_cell == '   ':
-            return False
+        return [column[:] for column in self._board]
+
+    def _set_cell(self, col: int, row: int, cell: str) -> None:
+        'Writes a cell of the game board and records it as changed, first copying the column if it is shared'
+        old = self._board[col][row]
+        if old != cell:
+            if col in self._shared_columns:
+                self._board[col] = self._board[col][:]
+                self._shared_columns.discard(col)
+            self._dirty_cells.add((col, row))
+            self._bitboards.replace(col, row, old, cell)
+            if self._hash is not None:
+                position_key = self._position_keys[col * len(self._board[col]) + row]
+                self._hash ^= ((position_key * _JEWEL_KEYS[old]) ^ (position_key * _JEWEL_KEYS[cell])) & _HASH_MASK
+            self._matched_cells += (cell[0] == '*') - (old[0] == '*')
+            if (old == '   ') != (cell == '   '):
+                self._count_filled(col, row, old == '   ')
+            self._board[col][row] = cell
+
+    def _set_column(self, col: int, column: list[str], stop: int = None) -> None:
+        'Replaces a column of the game board and records the cells that changed. When stop is given, the rows from stop down are known to be unchanged'
+        old_column = self._board[col]
+        start = 0
+        if stop is None:
+            stop = len(column)
+        while start < stop and old_column[start] == column[start]:
+            start += 1
+        while stop > start and old_column[stop-1] == column[stop-1]:
+            stop -= 1
+        if start < stop:
+            self._bitboards.replace_column(col, start, column[start:stop])
+        self._record_column(col, column, start, stop)
+
+    def _record_column(self, col: int, column: list[str], start: int, stop: int) -> None:
+        'Puts a column in the game board whose bitboards already hold it, recording the cells that changed between rows start and stop'
+        old_column = self._board[col]
+        if start < stop:
+            old_cells = old_column[start:stop]
+            cells = column[start:stop]
+            # Past the rescan limit the next update scans the whole board, so the cells are not worth recording
+            if len(self._dirty_cells) < self._rescan_limit:
+                self._dirty_cells.update(zip(itertools.repeat(col), range(start, stop)))
+            # A matching jewel such as "*R*" is the only cell with asterisks in it, and it has two
+            self._matched_cells += (''.join(cells).count('*') - ''.join(old_cells).count('*')) // 2
+            if self._hash is not None:
+                for row in range(start, stop):
+                    position_key = self._position_keys[col * len(column) + row]
+                    self._hash ^= ((position_key * _JEWEL_KEYS[old_column[row]]) ^ (position_key * _JEWEL_KEYS[column[row]])) & _HASH_MASK
+            self._count_column_filled(col, start, old_cells, cells)
+        self._board[col] = column
+        self._shared_columns.discard(col)
+
+    def _count_column_filled(self, col: int, start: int, old_cells: list[str], cells: list[str]) -> None:
+        'Updates the empty cell counts and free columns after the cells of a column from row start on are replaced'
+        hidden = max(0, self._hidden_rows - start)
+        self._hidden_jewels += old_cells[:hidden].count('   ') - cells[:hidden].count('   ')
+        self._set_empty_cells(col, self._empty_cells[col] + cells[hidden:].count('   ') - old_cells[hidden:].count('   '))
+
+    def _set_empty_cells(self, col: int, empty: int) -> None:
+        'Records the number of empty visible cells in a column, updating the free columns'
+        old_empty = self._empty_cells[col]
+        self._empty_cells[col] = empty
+        if old_empty and not empty:
+            self._free_columns.remove(col)
+        elif empty and not old_empty:
+            bisect.insort(self._free_columns, col)
+
+    def _count_filled(self, col: int, row: int, filled: bool) -> None:
+        'Updates the empty cell counts and free columns after a cell is filled, or emptied when filled is False'
+        if row < self._hidden_rows:
+            self._hidden_jewels += 1 if filled else -1
+            return
+        empty = self._empty_cells[col] - 1 if filled else self._empty_cells[col] + 1
+        self._empty_cells[col] = empty
+        if filled and empty == 0:
+            self._free_columns.remove(col)
+        elif not filled and empty == 1:
+            bisect.insort(self._free_columns, col)
+
+    def _run_cells(self) -> int:
+        'Returns a bitboard of every cell in a run of three or more, bringing the line runs up to date first'
+        self._update_line_runs()
+        cells = 0
+        for runs in self._line_runs:
+            cells |= runs
+        return cells
+
+    def _update_line_runs(self) -> None:
+        '''
+        Brings the line runs up to date by rescanning only the lines through cells written since the last update.
+        A cell's membership in a run along a line depends only on the two cells either side of it,
+        so only cells within two steps of a changed cell along each line can have changed.
+        When so many cells changed that rescanning their lines would cost more than scanning the
+        whole board, the whole board is scanned instead
+        '''
+        if not self._dirty_cells:
+            return
+        if len(self._dirty_cells) >= self._rescan_limit:
+            self._line_runs = self._scan_line_runs()
         else:
-            for i in range(1, 3):
-                if not self._is_valid_column_number(col + coldelta * i) \
-                        or not self._is_valid_row_number(row + rowdelta * i) \
-                        or self._board[col + coldelta *i][row + rowdelta * i] != start_cell:
-                    return False
-            return (True, coldelta, rowdelta)
-
-    def _remove_duplciates_in_positions(self, positions: list) -> list:
-        'Removes all duplicates in a list'
-        duplicates_removed = []
-        for position in positions:
-            if position not in duplicates_removed:
-                duplicates_removed.append(position)
-        return duplicates_removed
+            for line in range(len(bitboard.LINES)):
+                for col, row in self._dirty_cells:
+                    self._rescan_line_near(col, row, line)
+            if self._debug and bitboard.Bitboards(self._board).line_run_cells() != self._line_runs:
+                raise AssertionError('Incremental match search disagrees with a full scan of the board')
+        if self._debug and self._hash is not None and self._full_hash() != self._hash:
+            raise AssertionError('Incremental Zobrist hash disagrees with a hash of the whole board')
+        if self._debug and self._empty_cells != [column[self._hidden_rows:].count('   ') for column in self._board]:
+            raise AssertionError('Incremental empty cell counts disagree with a count over the whole board')
+        self._dirty_cells.clear()
+
+    def _scan_line_runs(self) -> list[int]:
+        'Scans the whole board, through the bitboards, for the cells in a run of three or more along each orientation in bitboard.LINES'
+        return self._bitboards.line_run_cells()
+
+    def _rescan_line_near(self, col: int, row: int, line: int) -> None:
+        'Updates which cells within two steps of (col, row) along a line are in a run of three or more along it'
+        coldelta, rowdelta = bitboard.LINES[line]
+        board = self._board
+        columns = len(board)
+        rows = len(board[0])
+        cells = []
+        for i in range(-4, 5):
+            c = col + coldelta * i
+            r = row + rowdelta * i
+            cells.append(board[c][r] if 0 <= c < columns and 0 <= r < rows else '   ')
+        in_run = [False] * 9
+        for start in range(7):
+            if cells[start] != '   ' and cells[start] == cells[start+1] == cells[start+2]:
+                in_run[start] = in_run[start+1] = in_run[start+2] = True
+        runs = self._line_runs[line]
+        for i in range(-2, 3):
+            c = col + coldelta * i
+            r = row + rowdelta * i
+            if 0 <= c < columns and 0 <= r < rows:
+                bit = self._bitboards.bit(c, r)
+                if in_run[i+4]:
+                    runs |= bit
+                elif runs & bit:
+                    runs ^= bit
+        self._line_runs[line] = runs
+
+    def _full_hash(self) -> int:
+        'Computes the Zobrist hash of the whole board'
+        codes = map(CELL_CODES.__getitem__, itertools.chain.from_iterable(self._board))
+        return zobrist_hash(self._board_columns(), self._board_rows(), enumerate(codes))
+
+    def _find_faller_and_matches(self) -> None:
+        'Records where the faller is and how many jewels are matching on a newly given game board'
+        for col in range(self._board_columns()):
+            for row in range(self._board_rows()):
+                cell = self._board[col][row]
+                if cell[0] == '*':
+                    self._matched_cells += 1
+                elif cell[0] in '[|':
+                    if self._faller_column is None:
+                        self._faller_column = col
+                        self._faller_top = row
+                        self._faller_landed = cell[0] == '|'
+                    self._faller_length += 1
 
     def _board_columns(self) -> int:
         'Returns the number of columns on the given game board'
@@ -282,3 +598,100 @@ class GameState:
         'Returns True if the given row number is valid; returns False otherwise'
         return 0 <= row_number < self._board_rows()
 
+
+
+def create_empty_board(rows: int, columns: int, hidden_rows: int = 2) -> list[list[str]]:
+    '''
+    Returns a columns game board based on a specified number of rows and columns. 
+    Invisible rows are added to take into account the faller that will be later added,
+    one fewer than the length of the faller. Raises ValueError for a board without rows or columns
+    '''
+    if rows < 1 or columns < 1 or hidden_rows < 0:
+        raise ValueError(f'a game board needs at least one row and one column, not {rows}x{columns} with {hidden_rows} hidden rows')
+    board = []
+    for col in range(columns):
+        board.append([])
+        for row in range(rows):
+            board[-1].append('   ')
+    _add_invisible_rows(board, hidden_rows)
+    return board
+
+
+def encode_cell(symbol: str) -> int:
+    'Returns the byte encoding of a cell string such as "[R]", "|R|", "*R*" or " R "'
+    return CELL_CODES[symbol]
+
+
+def decode_cell(code: int) -> str:
+    'Returns the cell string represented by a byte encoding'
+    return CELL_SYMBOLS[code]
+
+
+def board_to_bytes(board: list[list[str]], hidden_rows: int) -> bytes:
+    'Encodes a game board in one byte per cell, column by column, after a BOARD_HEADER giving its size'
+    cells = bytes(map(CELL_CODES.__getitem__, itertools.chain.from_iterable(board)))
+    return BOARD_HEADER.pack(len(board), len(board[0]), hidden_rows) + cells
+
+
+def board_from_bytes(data: bytes) -> tuple[list[list[str]], int]:
+    'Returns the game board encoded by board_to_bytes() and its number of hidden rows'
+    columns, rows, hidden_rows = BOARD_HEADER.unpack_from(data)
+    symbols = list(map(CELL_SYMBOLS.__getitem__, data[BOARD_HEADER.size:BOARD_HEADER.size + columns*rows]))
+    return [symbols[col*rows:(col+1)*rows] for col in range(columns)], hidden_rows
+
+
+def zobrist_hash(columns: int, rows: int, jewels: Iterable[tuple[int, int]]) -> int:
+    '''
+    Returns the Zobrist hash GameState keeps for a board of the given size holding the given jewels,
+    as (position, cell code) pairs with the positions numbered column by column
+    '''
+    keys = _position_keys(columns, rows)
+    board_hash = keys[-1]
+    for position, code in jewels:
+        board_hash ^= (keys[position] * _JEWEL_CODE_KEYS[code]) & _HASH_MASK
+    return board_hash
+
+
+def _add_invisible_rows(two_dimensional_list: list[list[str]], count: int) -> None:
+    'Adds count invisible rows to two-dimensional array.'
+    for col in two_dimensional_list:
+        for row in range(count):
+            col.insert(0, '   ')
+
+
+def _position_keys(columns: int, rows: int) -> list[int]:
+    '''
+    Returns a random 64-bit key for every position on a board of the given size, column by column,
+    followed by a key for the size itself. Every board of the same size gets the same keys
+    '''
+    keys = _POSITION_KEYS.get((columns, rows))
+    if keys is None:
+        rng = random.Random(f'zobrist {columns}x{rows}')
+        keys = [rng.getrandbits(64) for position in range(columns * rows + 1)]
+        _POSITION_KEYS[(columns, rows)] = keys
+    return keys
+
+
+def _cell_symbol(code: int) -> str:
+    'Returns the cell string for a byte of the to_bytes encoding'
+    color = _COLORS[code & 0b111]
+    if color == ' ':
+        return '   '
+    brackets = _STATE_BRACKETS[code >> 3]
+    return brackets[0] + color + brackets[1]
+
+
+# The to_bytes encoding stores the jewel color in the low three bits of a cell and its state
+# (frozen, falling, landed or matching) in the next two, the same bytes board_array uses.
+# CELL_SYMBOLS gives the cell string of every byte and CELL_CODES the byte of every cell string
+JEWEL_COLORS = 'ROYGBIV'
+_COLORS = ' ' + JEWEL_COLORS
+_STATE_BRACKETS = ('  ', '[]', '||', '**')
+CELL_SYMBOLS = tuple(_cell_symbol(code) for code in range(len(_STATE_BRACKETS) << 3))
+CELL_CODES = {symbol: code for code, symbol in reversed(list(enumerate(CELL_SYMBOLS)))}
+
+# The Zobrist key of a jewel at a position is the position's key times the jewel's key, modulo 2 ** 64.
+# Jewel keys are odd, so different jewels at one position never share a key, and an empty cell's key is 0
+_POSITION_KEYS = {}
+_JEWEL_CODE_KEYS = [0] + [random.Random(f'zobrist jewel {code}').getrandbits(64) | 1 for code in range(1, len(CELL_SYMBOLS))]
+_JEWEL_KEYS = {symbol: _JEWEL_CODE_KEYS[code] for symbol, code in CELL_CODES.items()}
@@ -0,0 +1,246 @@
+'''
+Searches for the best place to drop a faller, for an auto-player.
+
+A placement is a number of reverses followed by moves to a target column, after which the faller
+drops straight down and the board settles. Every placement of the current faller is tried, and
+with a depth above one, every placement of sampled future fallers is tried on each resulting
+board as well. Future fallers are random, so each deeper ply averages over a few fallers drawn
+from a seeded generator; every placement is scored against the same draws.
+
+Iterative deepening searches one ply, then two, and so on until max_depth or the time budget
+runs out, and the best placement of the deepest completed search is returned. The first ply is
+cheap and runs in this process. Deeper plies split into one task per placement and sampled
+faller, which run in a ProcessPoolExecutor. Given a cache size, this process and every worker
+keep a TranspositionCache, so boards reached along more than one line of play are only settled
+once. Different placements rarely lead to the same board, so the cache is off by default
+'''
+import concurrent.futures
+import random
+import time
+from typing import Callable, NamedTuple
+import game_mechanics
+import transposition_cache
+
+# A leaf is worth minus its jewel count, less this much per row of its tallest column
+_HEIGHT_WEIGHT = 0.5
+_DEAD = float('-inf')
+# The cache of a worker process, created when the worker starts
+_worker_cache = None
+
+
+class Placement(NamedTuple):
+    'Where a faller is dropped: how many times it is reversed, and the column it is moved to'
+    reverses: int
+    column: int
+
+
+class PlacementSearch:
+    '''
+    Finds the best placement of the current faller of a GameState, searching up to max_depth fallers
+    ahead within time_budget seconds. Deeper plies run in a pool of workers processes (one per core
+    when None); with workers set to 1, everything runs in this process. With cache_bytes above 0, each
+    process caches up to that many bytes of results. Close the search, or use it as a context manager,
+    to shut the pool down
+    '''
+    def __init__(self, max_depth: int = 2, time_budget: float = 0.5, workers: int = None, samples: int = 3, seed: int = 0,
+                 cache_bytes: int = 0):
+        self._max_depth = max_depth
+        self._time_budget = time_budget
+        self._samples = samples
+        self._random = random.Random(seed)
+        self._cache = transposition_cache.TranspositionCache(cache_bytes) if cache_bytes else None
+        self._executor = None
+        if workers != 1:
+            self._executor = concurrent.futures.ProcessPoolExecutor(workers, initializer = _start_worker, initargs = (cache_bytes,))
+
+    def __enter__(self) -> 'PlacementSearch':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def cache_stats(self) -> dict:
+        'Returns the hit and miss counts and size of the cache of this process, or None without a cache'
+        return None if self._cache is None else self._cache.stats()
+
+    def close(self) -> None:
+        'Shuts down the worker processes'
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures = True)
+
+    def best_placement(self, game_state: game_mechanics.GameState) -> tuple[Placement, int] | None:
+        '''
+        Returns the best placement of the current faller and the depth of the deepest search completed
+        in time, or None when there is no faller. The game state is not changed
+        '''
+        placements = list_placements(game_state)
+        if not placements:
+            return None
+        game_state = game_mechanics.GameState.from_bytes(game_state.to_bytes(), self._cache)
+        deadline = time.monotonic() + self._time_budget
+        values = {placement: _evaluate_placement(game_state, placement, (), deadline = None) for placement in placements}
+        depth = 1
+        while depth < self._max_depth and time.monotonic() < deadline:
+            draws = self._draw_fallers(game_state, depth)
+            deeper_values = self._evaluate_deeper(game_state, placements, draws, deadline)
+            if deeper_values is None:
+                break
+            values = deeper_values
+            depth += 1
+        return max(placements, key = lambda placement: values[placement]), depth
+
+    def best_actions(self, game_state: game_mechanics.GameState) -> list[str]:
+        'Returns the faller commands ("left", "right" or "reverse") that carry out the best placement'
+        best = self.best_placement(game_state)
+        if best is None:
+            return []
+        placement = best[0]
+        column = game_state.return_faller()[0]
+        moves = ['right' if placement.column > column else 'left'] * abs(placement.column - column)
+        return ['reverse'] * placement.reverses + moves
+
+    def _draw_fallers(self, game_state: game_mechanics.GameState, plies: int) -> list[list[tuple[float, list[str]]]]:
+        '''
+        Draws self._samples future fallers for each of the given number of plies. A faller's column
+        is drawn as a fraction of the board width, so it can be moved to a non-full column later
+        '''
+        length = len(game_state.return_faller()[1])
+        return [[(self._random.random(), ['[' + self._random.choice(game_mechanics.JEWEL_COLORS) + ']' for i in range(length)])
+                 for sample in range(self._samples)] for ply in range(plies)]
+
+    def _evaluate_deeper(self, game_state: game_mechanics.GameState, placements: list[Placement],
+                         draws: list[list[tuple[float, list[str]]]], deadline: float) -> dict[Placement, float] | None:
+        '''
+        Returns the value of every placement searched len(draws) fallers deeper, averaged over the first
+        ply's draws, or None if the deadline passes first. Each placement and draw is a separate task
+        '''
+        tasks = [(placement, sample) for placement in placements for sample in range(len(draws[0]))]
+        if self._executor is None:
+            results = [_evaluate_placement(game_state, placement, _with_first_draw(draws, sample), deadline) for placement, sample in tasks]
+        else:
+            data = game_state.to_bytes()
+            seconds = deadline - time.monotonic()
+            futures = [self._executor.submit(_evaluate_encoded_placement, data, placement, _with_first_draw(draws, sample), seconds)
+                       for placement, sample in tasks]
+            done, pending = concurrent.futures.wait(futures, timeout = max(0.0, seconds))
+            for future in pending:
+                future.cancel()
+            if pending:
+                return None
+            results = [future.result() for future in futures]
+        if None in results:
+            return None
+        values = {placement: 0.0 for placement in placements}
+        for (placement, sample), result in zip(tasks, results):
+            values[placement] += result / len(draws[0])
+        return values
+
+
+def search_input(game, search: PlacementSearch) -> Callable[[int], list[str]]:
+    '''
+    Returns an input source for ColumnsGame.run_headless that plays game with search, issuing the
+    commands for the best placement on the first frame each new faller can be controlled
+    '''
+    planned = [0]
+
+    def next_commands(frame: int) -> list[str]:
+        if game.return_fallers_created() == planned[0]:
+            return []
+        planned[0] = game.return_fallers_created()
+        return search.best_actions(game.return_game_state())
+    return next_commands
+
+
+def list_placements(game_state: game_mechanics.GameState) -> list[Placement]:
+    'Returns every distinct placement of the current faller, skipping reverses that give the same order of colors'
+    faller = game_state.return_faller()
+    if faller is None:
+        return []
+    colors = [jewel[1] for jewel in faller[1]]
+    orders = []
+    placements = []
+    for reverses in range(len(colors)):
+        order = colors[len(colors) - reverses:] + colors[:len(colors) - reverses]
+        if order not in orders:
+            orders.append(order)
+            placements.extend(Placement(reverses, column) for column in range(len(game_state.return_board())))
+    return placements
+
+
+def _with_first_draw(draws: list[list[tuple[float, list[str]]]], sample: int) -> list[list[tuple[float, list[str]]]]:
+    'Returns the draws with the first ply narrowed down to one sampled faller'
+    return [[draws[0][sample]]] + draws[1:]
+
+
+def _start_worker(cache_bytes: int) -> None:
+    'Creates the cache of a worker process'
+    global _worker_cache
+    if cache_bytes:
+        _worker_cache = transposition_cache.TranspositionCache(cache_bytes)
+
+
+def _evaluate_encoded_placement(data: bytes, placement: Placement, draws: list[list[tuple[float, list[str]]]], seconds: float) -> float | None:
+    'Evaluates a placement on a game encoded with GameState.to_bytes, in a worker process'
+    return _evaluate_placement(game_mechanics.GameState.from_bytes(data, _worker_cache), placement, draws, time.monotonic() + seconds)
+
+
+def _evaluate_placement(game_state: game_mechanics.GameState, placement: Placement,
+                        draws: list[list[tuple[float, list[str]]]], deadline: float | None) -> float | None:
+    '''
+    Returns the value of making a placement on a clone of game_state, followed by the best placement of
+    every drawn faller, ply by ply, averaged over the draws of each ply. Returns None if the deadline passes
+    '''
+    if deadline is not None and time.monotonic() > deadline:
+        return None
+    game_state = game_state.clone()
+    if make_placement(game_state, placement) is None:
+        return _DEAD
+    if game_state.check_if_dead():
+        return _DEAD
+    if not draws:
+        return _leaf_value(game_state)
+    total = 0.0
+    for fraction, jewels in draws[0]:
+        columns = game_state.free_columns()
+        if not columns:
+            return _DEAD
+        spawned = game_state.clone()
+        spawned.put_faller_in_board((columns[int(fraction * len(columns))], jewels))
+        best = _DEAD
+        for next_placement in list_placements(spawned):
+            value = _evaluate_placement(spawned, next_placement, draws[1:], deadline)
+            if value is None:
+                return None
+            best = max(best, value)
+        total += best
+    return total / len(draws[0])
+
+
+def make_placement(game_state: game_mechanics.GameState, placement: Placement) -> list[game_mechanics.CascadeStep] | None:
+    '''
+    Reverses and moves the faller, then drops it and settles the board, returning the chain of cells
+    cleared as it settled. Returns None if the faller could not reach its column
+    '''
+    for reverse in range(placement.reverses):
+        game_state.faller_reverse()
+    column = game_state.return_faller()[0]
+    step = 1 if placement.column > column else -1
+    while column != placement.column:
+        if game_state.faller_move_delta(step) != column + step:
+            return None
+        column += step
+    while game_state.return_faller() is not None:
+        game_state.faller_pass_time()
+    return game_state.resolve_cascades()
+
+
+def _leaf_value(game_state: game_mechanics.GameState) -> float:
+    'Scores a settled board: fewer jewels and a lower tallest column are better'
+    board = game_state.return_board()
+    jewels = 0
+    tallest = 0
+    for column in board:
+        empties = column.count('   ')
+        jewels += len(column) - empties
+        tallest = max(tallest, len(column) - empties)
+    return -jewels - _HEIGHT_WEIGHT * tallest
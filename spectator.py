@@ -0,0 +1,446 @@
+'''
+Streams live games to spectators over local TCP or Unix sockets.
+
+After every tick the server compares the board with the one it last sent and broadcasts the cells
+that changed. Every message is a header giving its kind, the frame number and the payload length.
+A keyframe's payload is a whole board encoded by GameState.to_bytes; a delta's payload lists the
+changed cells, each as its position (column * rows + row) and its cell code. A delta is encoded
+once and written to every client. Frames that changed nothing send no message.
+
+Writes never wait for a client. When a client's unsent data goes over the buffer limit, the
+server skips it until its buffer drains, then sends it a fresh keyframe, so a slow spectator
+misses frames instead of stalling the game loop or the other spectators.
+
+    python spectator.py serve [--address HOST:PORT|unix:PATH] [--seed SEED]
+    python spectator.py watch [--address HOST:PORT|unix:PATH]
+    python spectator.py load-test [--spectators N] [--stalled N]
+'''
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import socket
+import struct
+import sys
+import tempfile
+import time
+from typing import Callable, Iterable, NamedTuple
+import columns_game
+import command_line
+import frame_scheduler
+import game_mechanics
+
+KEYFRAME = 0
+DELTA = 1
+_MESSAGE_HEADER = struct.Struct('<BII')
+_CHANGE = struct.Struct('<IB')
+_DEFAULT_PORT = 7531
+# The read buffer of a load test spectator that stalls
+_STALLED_READ_LIMIT = 1024
+
+
+class Message(NamedTuple):
+    'A message of the stream: its kind (KEYFRAME or DELTA), the frame it was sent after, and its payload'
+    kind: int
+    frame: int
+    payload: bytes
+
+
+class ServedGame(NamedTuple):
+    'The outcome of serve_game: the frames played, and how many of them ran late to catch up with the wall clock'
+    frames: int
+    catch_up_frames: int
+
+
+class ServerStats(NamedTuple):
+    'What a SpectatorServer has sent so far'
+    clients: int
+    keyframes: int
+    deltas: int
+    skipped: int
+    bytes_sent: int
+
+
+class BoardDiffer:
+    '''
+    Finds the cells of a GameState that changed since the previous call. The previous board is kept as
+    a snapshot, which shares the columns of the game, so a column that was not written to since is
+    the same list and is not compared cell by cell
+    '''
+    def __init__(self):
+        self._previous = None
+
+    def changes(self, game_state: game_mechanics.GameState) -> list[tuple[int, int]] | None:
+        'Returns the (position, cell code) of every changed cell, or None on the first call or when the board size changed'
+        previous = self._previous
+        self._previous = game_state.snapshot()
+        board = self._previous.board
+        if previous is None or len(previous.board) != len(board) or len(previous.board[0]) != len(board[0]):
+            return None
+        rows = len(board[0])
+        changes = []
+        for col, (old, new) in enumerate(zip(previous.board, board)):
+            if old is not new:
+                changes.extend((col * rows + row, game_mechanics.CELL_CODES[cell])
+                               for row, (old_cell, cell) in enumerate(zip(old, new)) if old_cell != cell)
+        return changes
+
+    def to_bytes(self) -> bytes | None:
+        'Encodes the board given to the last call as GameState.to_bytes does, or returns None before the first call'
+        if self._previous is None:
+            return None
+        return game_mechanics.board_to_bytes(self._previous.board, self._previous.hidden_rows)
+
+
+class SpectatorServer:
+    '''
+    Sends the boards given to publish() to every connected spectator: a keyframe to a spectator that
+    just connected or fell behind, and the changed cells otherwise. A spectator whose unsent data
+    goes over buffer_limit bytes is skipped until its buffer drains, and is then sent a keyframe of
+    the last published board. socket_buffer sets the size of the kernel's send buffer for each
+    spectator, which holds data before it counts towards buffer_limit; None keeps the system default
+    '''
+    def __init__(self, buffer_limit: int = 64 * 1024, socket_buffer: int = None):
+        self._buffer_limit = buffer_limit
+        self._socket_buffer = socket_buffer
+        self._clients = set()
+        self._differ = BoardDiffer()
+        self._frame = 0
+        self._keyframe = None
+        self._servers = []
+        self._keyframes = 0
+        self._deltas = 0
+        self._skipped = 0
+        self._bytes_sent = 0
+
+    async def listen_tcp(self, host: str = '127.0.0.1', port: int = _DEFAULT_PORT) -> None:
+        'Accepts spectators on a TCP address'
+        loop = asyncio.get_running_loop()
+        self._servers.append(await loop.create_server(lambda: _SpectatorProtocol(self), host, port))
+
+    async def listen_unix(self, path: str) -> None:
+        'Accepts spectators on a Unix socket'
+        loop = asyncio.get_running_loop()
+        self._servers.append(await loop.create_unix_server(lambda: _SpectatorProtocol(self), path))
+
+    def publish(self, frame: int, game_state: game_mechanics.GameState) -> None:
+        'Sends the board of game_state after the given frame to every spectator that can take it'
+        changes = self._differ.changes(game_state)
+        self._frame = frame
+        self._keyframe = None
+        delta = None
+        if changes is None:
+            for client in self._clients:
+                client.needs_keyframe = True
+        for client in self._clients:
+            if client.paused:
+                if changes != []:
+                    self._skipped += 1
+            elif client.needs_keyframe:
+                self._send_keyframe(client)
+            elif changes:
+                if delta is None:
+                    delta = encode_message(DELTA, frame, encode_changes(changes))
+                self._send(client, delta)
+                self._deltas += 1
+
+    def stats(self) -> ServerStats:
+        'Returns the number of connected spectators and how many messages were sent and skipped'
+        return ServerStats(len(self._clients), self._keyframes, self._deltas, self._skipped, self._bytes_sent)
+
+    async def close(self, timeout: float = 5.0) -> None:
+        '''
+        Stops accepting spectators, waits up to timeout seconds for the spectators that are behind to
+        catch up with the last published board, then disconnects every spectator once its unsent data is written
+        '''
+        for server in self._servers:
+            server.close()
+        deadline = asyncio.get_running_loop().time() + timeout
+        while any(client.paused for client in self._clients) and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.01)
+        for client in list(self._clients):
+            client.transport.close()
+        for server in self._servers:
+            await server.wait_closed()
+        self._servers = []
+
+    def _send_keyframe(self, client: '_SpectatorProtocol') -> None:
+        'Sends a client a keyframe of the last published board, if there is one'
+        if self._keyframe is None:
+            data = self._differ.to_bytes()
+            if data is None:
+                return
+            self._keyframe = encode_message(KEYFRAME, self._frame, data)
+        client.needs_keyframe = False
+        self._send(client, self._keyframe)
+        self._keyframes += 1
+
+    def _send(self, client: '_SpectatorProtocol', message: bytes) -> None:
+        'Writes a message to a client without waiting for it to be sent'
+        client.transport.write(message)
+        self._bytes_sent += len(message)
+
+
+class _SpectatorProtocol(asyncio.Protocol):
+    'The connection to one spectator. The transport calls pause_writing and resume_writing as its buffer fills and drains'
+    def __init__(self, server: SpectatorServer):
+        self._server = server
+        self.transport = None
+        self.paused = False
+        self.needs_keyframe = True
+
+    def connection_made(self, transport: asyncio.WriteTransport) -> None:
+        self.transport = transport
+        transport.set_write_buffer_limits(high = self._server._buffer_limit)
+        if self._server._socket_buffer is not None:
+            transport.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self._server._socket_buffer)
+        self._server._clients.add(self)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self._server._clients.discard(self)
+
+    def pause_writing(self) -> None:
+        self.paused = True
+
+    def resume_writing(self) -> None:
+        self.paused = False
+        self.needs_keyframe = True
+        self._server._send_keyframe(self)
+
+
+class SpectatorBoard:
+    'The board of a served game as seen by a spectator, kept up to date from the messages of the stream'
+    def __init__(self):
+        self.frame = None
+        self.keyframes = 0
+        self.deltas = 0
+        self.hidden_rows = 0
+        self._header = None
+        self._rows = 0
+        self._cells = None
+
+    def apply(self, message: Message) -> None:
+        'Updates the board with a message. Deltas that arrive before the first keyframe are ignored'
+        if message.kind == KEYFRAME:
+            header_size = game_mechanics.BOARD_HEADER.size
+            self._header = message.payload[:header_size]
+            columns, self._rows, self.hidden_rows = game_mechanics.BOARD_HEADER.unpack(self._header)
+            self._cells = bytearray(message.payload[header_size:])
+            self.keyframes += 1
+        elif self._cells is not None:
+            cells = self._cells
+            for position, code in _CHANGE.iter_unpack(message.payload):
+                cells[position] = code
+            self.deltas += 1
+        else:
+            return
+        self.frame = message.frame
+
+    def to_bytes(self) -> bytes | None:
+        'Returns the board in the encoding of GameState.to_bytes, or None before the first keyframe'
+        if self._cells is None:
+            return None
+        return self._header + bytes(self._cells)
+
+    def return_board(self) -> list[list[str]] | None:
+        'Returns the board as a list of columns of cell strings, as GameState.return_board does, or None before the first keyframe'
+        if self._cells is None:
+            return None
+        symbols = list(map(game_mechanics.decode_cell, self._cells))
+        return [symbols[start:start + self._rows] for start in range(0, len(symbols), self._rows)]
+
+
+def encode_message(kind: int, frame: int, payload: bytes) -> bytes:
+    'Returns a message of the stream: a header giving its kind, frame and payload length, then the payload'
+    return _MESSAGE_HEADER.pack(kind, frame, len(payload)) + payload
+
+
+def encode_changes(changes: Iterable[tuple[int, int]]) -> bytes:
+    'Returns the payload of a delta listing (position, cell code) changes'
+    return b''.join(itertools.starmap(_CHANGE.pack, changes))
+
+
+async def read_message(reader: asyncio.StreamReader) -> Message | None:
+    'Reads the next message of the stream, or returns None once the server has closed the connection'
+    try:
+        header = await reader.readexactly(_MESSAGE_HEADER.size)
+        kind, frame, length = _MESSAGE_HEADER.unpack(header)
+        return Message(kind, frame, await reader.readexactly(length))
+    except asyncio.IncompleteReadError:
+        return None
+
+
+async def open_stream(address: str, limit: int = 64 * 1024) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    'Connects to a server at "unix:PATH" or "HOST:PORT". The reader stops taking data once about limit bytes are waiting to be read'
+    if address.startswith('unix:'):
+        return await asyncio.open_unix_connection(address[len('unix:'):], limit = limit)
+    host, port = address.rsplit(':', 1)
+    return await asyncio.open_connection(host, int(port), limit = limit)
+
+
+async def listen(server: SpectatorServer, address: str) -> None:
+    'Makes a server accept spectators at "unix:PATH" or "HOST:PORT"'
+    if address.startswith('unix:'):
+        await server.listen_unix(address[len('unix:'):])
+    else:
+        host, port = address.rsplit(':', 1)
+        await server.listen_tcp(host, int(port))
+
+
+async def serve_game(game: columns_game.ColumnsGame, server: SpectatorServer, input_source: Callable[[int], Iterable[str]] = None,
+                     frame_rate: float = columns_game._FRAME_RATE, max_frames: int = None) -> ServedGame:
+    '''
+    Plays game frame_rate frames per second of wall-clock time, publishing its board to server after
+    every tick, until it ends or max_frames pass. input_source is used as in ColumnsGame.run_headless.
+    Spectators that are behind when it ends get the final board once they catch up
+    '''
+    scheduler = frame_scheduler.FixedStepScheduler(frame_rate, clock = asyncio.get_running_loop().time)
+    frame = 0
+    catch_up_frames = 0
+    active = True
+    server.publish(frame, game.return_game_state())
+    while active and (max_frames is None or frame < max_frames):
+        await asyncio.sleep(scheduler.seconds_until_step())
+        steps = scheduler.steps_due()
+        catch_up_frames += max(0, steps - 1)
+        for step in range(steps):
+            active = game.advance_frame(input_source, frame)
+            frame += 1
+            if not active or frame == max_frames:
+                break
+        server.publish(frame, game.return_game_state())
+    return ServedGame(frame, catch_up_frames)
+
+
+async def watch(address: str, render: Callable[[SpectatorBoard], None]) -> SpectatorBoard:
+    'Follows the stream of the server at address, calling render after every message, until the server closes it'
+    reader, writer = await open_stream(address)
+    board = SpectatorBoard()
+    try:
+        while (message := await read_message(reader)) is not None:
+            board.apply(message)
+            render(board)
+    finally:
+        writer.close()
+    return board
+
+
+def render_text(board: SpectatorBoard) -> None:
+    'Redraws the visible rows of a spectated board in the terminal'
+    columns = board.return_board()
+    if columns is None:
+        return
+    lines = [''.join(row) for row in itertools.islice(zip(*columns), board.hidden_rows, None)]
+    width = len(lines[0]) if lines else 0
+    sys.stdout.write('\x1b[H\x1b[2J' + '\n'.join('|' + line + '|' for line in lines) + '\n ' + '-' * width +
+                     f'\nframe {board.frame}\n')
+    sys.stdout.flush()
+
+
+class LoadTestResult(NamedTuple):
+    'The outcome of a load test'
+    frames: int
+    seconds: float
+    catch_up_frames: int
+    server: ServerStats
+    spectators_in_sync: int
+    spectators: int
+
+
+async def load_test(spectators: int = 300, stalled: int = 10, rows: int = 13, columns: int = 6, frame_rate: float = columns_game._FRAME_RATE,
+                    max_frames: int = 300, stall_seconds: float = 5.0, buffer_limit: int = 1024, socket_buffer: int = 4096,
+                    seed: int = 0) -> LoadTestResult:
+    '''
+    Serves a seeded game with a random command on every frame to many spectators over a Unix socket. The first stalled
+    spectators stop reading for stall_seconds partway through, with small buffers on both ends of
+    their connections so that they soon fall behind. Counts the frames the game loop ran
+    late, catching up with the wall clock, and how many spectators end up with the final board
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        address = 'unix:' + os.path.join(directory, 'spectators')
+        server = SpectatorServer(buffer_limit, socket_buffer)
+        await listen(server, address)
+        game = columns_game.ColumnsGame(rows, columns, rng = random.Random(seed))
+        boards = [SpectatorBoard() for spectator in range(spectators)]
+        connections = [await open_stream(address, _STALLED_READ_LIMIT if spectator < stalled else 64 * 1024) for spectator in range(spectators)]
+        while server.stats().clients < spectators:
+            await asyncio.sleep(0)
+        loop = asyncio.get_running_loop()
+        readers = [loop.create_task(_spectate(reader, board, stall_seconds if index < stalled else 0))
+                   for index, ((reader, writer), board) in enumerate(zip(connections, boards))]
+        start = time.perf_counter()
+        served = await serve_game(game, server, columns_game.random_input(random.Random(seed), 1.0), frame_rate, max_frames)
+        seconds = time.perf_counter() - start
+        final = game.return_game_state().to_bytes()
+        await server.close()
+        await asyncio.gather(*readers)
+        for reader, writer in connections:
+            writer.close()
+        in_sync = sum(board.to_bytes() == final for board in boards)
+        return LoadTestResult(served.frames, seconds, served.catch_up_frames, server.stats(), in_sync, spectators)
+
+
+async def _spectate(reader: asyncio.StreamReader, board: SpectatorBoard, stall_seconds: float) -> None:
+    'Applies every message of the stream to board, stopping reading for stall_seconds after the first few messages if above 0'
+    while (message := await read_message(reader)) is not None:
+        board.apply(message)
+        if stall_seconds and board.keyframes + board.deltas == 10:
+            await asyncio.sleep(stall_seconds)
+
+
+def _serve_from_command_line(options: argparse.Namespace) -> None:
+    'Serves a seeded game with random input until it ends, then waits for spectators to catch up'
+    async def serve() -> None:
+        server = SpectatorServer()
+        await listen(server, options.address)
+        game = columns_game.ColumnsGame(options.rows, options.columns, options.faller_length, rng = random.Random(options.seed))
+        served = await serve_game(game, server, columns_game.random_input(random.Random(options.seed)))
+        await server.close()
+        print(f'{served.frames} frames served, {served.catch_up_frames} late: {server.stats()}')
+    asyncio.run(serve())
+
+
+def _run_load_test_from_command_line(options: argparse.Namespace) -> None:
+    'Runs a load test and reports how the game loop and the spectators kept up'
+    result = asyncio.run(load_test(options.spectators, options.stalled, options.rows, options.columns, options.frame_rate,
+                                   options.frames, options.stall_seconds, options.buffer_limit, options.socket_buffer, options.seed))
+    print(f'{result.frames} frames in {result.seconds:.3f}s, {result.catch_up_frames} run late to catch up')
+    print(f'{result.server.keyframes} keyframes, {result.server.deltas} deltas and {result.server.bytes_sent} bytes sent, '
+          f'{result.server.skipped} messages skipped for spectators that were behind')
+    print(f'{result.spectators_in_sync} of {result.spectators} spectators ended with the final board')
+
+
+def _parse_command_line(arguments: list[str]) -> argparse.Namespace:
+    'Parses the mode, address and game settings given on the command line'
+    parser = argparse.ArgumentParser(description = 'Stream Columns games to spectators')
+    modes = parser.add_subparsers(dest = 'mode', required = True)
+    serve = modes.add_parser('serve', help = 'play a seeded game with random input and stream it')
+    watch = modes.add_parser('watch', help = 'draw a streamed game in the terminal')
+    load = modes.add_parser('load-test', help = 'stream a game to many local spectators and report how they kept up')
+    for mode in (serve, watch):
+        mode.add_argument('--address', default = f'127.0.0.1:{_DEFAULT_PORT}', metavar = 'HOST:PORT|unix:PATH',
+                          help = 'where the server accepts spectators')
+    for mode in (serve, load):
+        mode.add_argument('--rows', type = command_line.positive_int, default = 13, help = 'number of visible rows on the board')
+        mode.add_argument('--columns', type = command_line.positive_int, default = 6, help = 'number of columns on the board')
+        mode.add_argument('--seed', type = int, default = 0, help = 'seed of the game and its random input')
+    serve.add_argument('--faller-length', type = command_line.positive_int, default = 3, help = 'number of jewels in every faller')
+    load.add_argument('--spectators', type = int, default = 300, help = 'number of spectators')
+    load.add_argument('--stalled', type = int, default = 10, help = 'number of spectators that stop reading for a while')
+    load.add_argument('--stall-seconds', type = float, default = 5.0, help = 'how long stalled spectators stop reading')
+    load.add_argument('--frames', type = int, default = 300, help = 'number of frames to play')
+    load.add_argument('--frame-rate', type = command_line.positive_float, default = columns_game._FRAME_RATE, help = 'frames of game logic per second')
+    load.add_argument('--buffer-limit', type = int, default = 1024, help = 'bytes of unsent data after which a spectator is skipped')
+    load.add_argument('--socket-buffer', type = int, default = 4096, help = 'size of the kernel send buffer of each spectator')
+    return parser.parse_args(arguments)
+
+
+if __name__ == '__main__':
+    options = _parse_command_line(sys.argv[1:])
+    if options.mode == 'serve':
+        _serve_from_command_line(options)
+    elif options.mode == 'watch':
+        asyncio.run(watch(options.address, render_text))
+    else:
+        _run_load_test_from_command_line(options)
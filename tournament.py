@@ -0,0 +1,241 @@
+'''
+Plays many seeded games without a display to gather statistics for balancing the game.
+
+    python tournament.py [--games 100000] [--policy random] [--colors ROYGBIV] [--output DIRECTORY]
+
+Each game drives a GameState directly, one faller at a time: a faller of random colors appears
+in a random non-full column, the policy picks where it goes, it drops, and the board settles. A
+game ends when a column is full or after --max-fallers fallers. Its survival length is the number
+of fallers placed, its deepest chain is the longest cascade of matches one faller set off, and
+its cells cleared counts every jewel removed by a match.
+
+Games are split into shards of consecutive seeds, which run in a ProcessPoolExecutor. A worker
+sends back only the merged statistics of its shard; given an output directory, it also writes the
+records of its games there in columnar form, one file per shard, which read_records() loads.
+'''
+import argparse
+import array
+import concurrent.futures
+import os
+import random
+import struct
+import sys
+import time
+from typing import Callable, NamedTuple
+import command_line
+import game_mechanics
+import placement_search
+
+_DEFAULT_COLORS = game_mechanics.JEWEL_COLORS
+# The fields of a game record, in the order they are stored in a shard file, and their array type codes
+RECORD_FIELDS = (('seed', 'Q'), ('fallers', 'I'), ('deepest_chain', 'I'), ('cells_cleared', 'I'))
+_SHARD_HEADER = struct.Struct('<QI')
+# The search used by the greedy policy in this process, created on first use
+_greedy_search = None
+
+
+class GameRecord(NamedTuple):
+    'The outcome of one game'
+    seed: int
+    fallers: int
+    deepest_chain: int
+    cells_cleared: int
+
+
+class TournamentStats(NamedTuple):
+    'Statistics merged over a number of games. chain_depths counts the games by their deepest chain'
+    games: int
+    fallers: int
+    shortest_game: int
+    longest_game: int
+    cells_cleared: int
+    deepest_chain: int
+    chain_depths: dict[int, int]
+
+
+class TournamentResult(NamedTuple):
+    'The statistics of a tournament and how fast its games were played'
+    stats: TournamentStats
+    seconds: float
+    games_per_second: float
+
+
+def drop_policy(game_state: game_mechanics.GameState, rng: random.Random) -> placement_search.Placement:
+    'Drops every faller where it appears'
+    return placement_search.Placement(0, game_state.return_faller()[0])
+
+
+def random_policy(game_state: game_mechanics.GameState, rng: random.Random) -> placement_search.Placement:
+    'Drops every faller at a random placement'
+    return rng.choice(placement_search.list_placements(game_state))
+
+
+def greedy_policy(game_state: game_mechanics.GameState, rng: random.Random) -> placement_search.Placement:
+    'Drops every faller at the placement that leaves the fewest jewels and the lowest tallest column'
+    global _greedy_search
+    if _greedy_search is None:
+        _greedy_search = placement_search.PlacementSearch(max_depth = 1, workers = 1)
+    return _greedy_search.best_placement(game_state)[0]
+
+
+POLICIES = {
+    'drop': drop_policy,
+    'random': random_policy,
+    'greedy': greedy_policy,
+}
+
+
+def play_game(seed: int, policy: Callable[[game_mechanics.GameState, random.Random], placement_search.Placement], rows: int = 13,
+              columns: int = 6, faller_length: int = 3, colors: str = _DEFAULT_COLORS, max_fallers: int = 10000) -> GameRecord:
+    'Plays a seeded game with policy until a column is full or max_fallers fallers are placed'
+    rng = random.Random(seed)
+    game_state = game_mechanics.GameState(game_mechanics.create_empty_board(rows, columns, faller_length - 1), faller_length)
+    fallers = 0
+    deepest_chain = 0
+    cells_cleared = 0
+    while fallers < max_fallers:
+        free_columns = game_state.free_columns()
+        if not free_columns:
+            break
+        game_state.put_faller_in_board((rng.choice(free_columns), ['[' + rng.choice(colors) + ']' for i in range(faller_length)]))
+        steps = placement_search.make_placement(game_state, policy(game_state, rng))
+        if steps is None:
+            # The faller was blocked on its way, so it drops where it stopped
+            while game_state.return_faller() is not None:
+                game_state.faller_pass_time()
+            steps = game_state.resolve_cascades()
+        fallers += 1
+        deepest_chain = max(deepest_chain, len(steps))
+        cells_cleared += sum(step.cleared for step in steps)
+        if game_state.check_if_dead():
+            break
+    return GameRecord(seed, fallers, deepest_chain, cells_cleared)
+
+
+def merge_stats(first: TournamentStats, second: TournamentStats) -> TournamentStats:
+    'Returns the statistics of the games of both'
+    if not first.games:
+        return second
+    if not second.games:
+        return first
+    chain_depths = dict(first.chain_depths)
+    for depth, games in second.chain_depths.items():
+        chain_depths[depth] = chain_depths.get(depth, 0) + games
+    return TournamentStats(first.games + second.games, first.fallers + second.fallers, min(first.shortest_game, second.shortest_game),
+                           max(first.longest_game, second.longest_game), first.cells_cleared + second.cells_cleared,
+                           max(first.deepest_chain, second.deepest_chain), chain_depths)
+
+
+def run_tournament(games: int, policy: str = 'random', first_seed: int = 0, shard_size: int = 1000, workers: int = None,
+                   output: str = None, progress: Callable[[TournamentStats, float], None] = None, **game_options) -> TournamentResult:
+    '''
+    Plays games with consecutive seeds from first_seed with the named policy, in shards of shard_size
+    games spread over workers processes (one per core when None). game_options are passed to play_game.
+    progress, if given, is called with the statistics so far and the seconds elapsed as each shard finishes.
+    output, if given, must be a new or empty directory, so read_records() finds only the shards of this tournament
+    '''
+    start = time.perf_counter()
+    stats = _EMPTY_STATS
+    shards = [(seed, min(shard_size, first_seed + games - seed)) for seed in range(first_seed, first_seed + games, shard_size)]
+    if output is not None:
+        os.makedirs(output, exist_ok = True)
+        if os.listdir(output):
+            raise FileExistsError(f'output directory {output} is not empty')
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(_play_shard, seed, count, policy, output, game_options) for seed, count in shards]
+        for future in concurrent.futures.as_completed(futures):
+            stats = merge_stats(stats, future.result())
+            if progress is not None:
+                progress(stats, time.perf_counter() - start)
+    seconds = time.perf_counter() - start
+    return TournamentResult(stats, seconds, stats.games / seconds if seconds > 0 else float('inf'))
+
+
+def read_records(directory: str) -> dict[str, array.array]:
+    '''
+    Returns every game record written to an output directory, as one array per field, ordered by seed.
+    Raises ValueError unless the seeds of the records are unique and consecutive
+    '''
+    fields = {name: array.array(code) for name, code in RECORD_FIELDS}
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.shard'):
+            continue
+        with open(os.path.join(directory, name), 'rb') as shard:
+            first_seed, games = _SHARD_HEADER.unpack(shard.read(_SHARD_HEADER.size))
+            expected_seed = fields['seed'][-1] + 1 if fields['seed'] else first_seed
+            for field, code in RECORD_FIELDS:
+                fields[field].fromfile(shard, games)
+        if fields['seed'][-games:] != array.array(fields['seed'].typecode, range(expected_seed, expected_seed + games)):
+            raise ValueError(f'shard {name} holds seeds {first_seed} to {first_seed + games - 1}, expected them to start at {expected_seed}')
+    return fields
+
+
+def _play_shard(first_seed: int, games: int, policy: str, output: str | None, game_options: dict) -> TournamentStats:
+    'Plays a shard of games in a worker process, writing their records to output if given, and returns their statistics'
+    play = POLICIES[policy]
+    columns = {name: array.array(code) for name, code in RECORD_FIELDS}
+    chain_depths = {}
+    for seed in range(first_seed, first_seed + games):
+        record = play_game(seed, play, **game_options)
+        for name, value in zip(GameRecord._fields, record):
+            columns[name].append(value)
+        chain_depths[record.deepest_chain] = chain_depths.get(record.deepest_chain, 0) + 1
+    if output is not None:
+        with open(os.path.join(output, f'{first_seed:012}.shard'), 'wb') as shard:
+            shard.write(_SHARD_HEADER.pack(first_seed, games))
+            for name, code in RECORD_FIELDS:
+                columns[name].tofile(shard)
+    fallers = columns['fallers']
+    return TournamentStats(games, sum(fallers), min(fallers), max(fallers), sum(columns['cells_cleared']),
+                           max(columns['deepest_chain']), chain_depths)
+
+
+_EMPTY_STATS = TournamentStats(0, 0, 0, 0, 0, 0, {})
+
+
+def _report(stats: TournamentStats, seconds: float) -> str:
+    'Returns a summary of the statistics and the rate they were gathered at'
+    if stats.games == 0:
+        return f'0 games in {seconds:.1f}s'
+    return (f'{stats.games} games in {seconds:.1f}s ({stats.games / max(seconds, 1e-9):.0f} games per second): '
+            f'{stats.fallers / stats.games:.1f} fallers per game (shortest {stats.shortest_game}, longest {stats.longest_game}), '
+            f'{stats.cells_cleared / stats.games:.1f} cells cleared per game, deepest chain {stats.deepest_chain}')
+
+
+def _parse_colors(text: str) -> str:
+    'Parses the letters of the jewel colors fallers are drawn from, which must be colors the game can draw'
+    unknown = sorted(set(text) - set(game_mechanics.JEWEL_COLORS))
+    if not text or unknown:
+        raise argparse.ArgumentTypeError(f"colors must be letters of {game_mechanics.JEWEL_COLORS}, not {''.join(unknown) or 'none'}")
+    return text
+
+
+def main(arguments: list[str]) -> int:
+    parser = argparse.ArgumentParser(description = 'Play many seeded Columns games without a display and report statistics')
+    parser.add_argument('--games', type = command_line.positive_int, default = 10000, help = 'number of games to play')
+    parser.add_argument('--first-seed', type = command_line.non_negative_int, default = 0, help = 'seed of the first game; the others follow it')
+    parser.add_argument('--policy', choices = sorted(POLICIES), default = 'random', help = 'how fallers are placed')
+    parser.add_argument('--rows', type = command_line.positive_int, default = 13, help = 'number of visible rows on the board')
+    parser.add_argument('--columns', type = command_line.positive_int, default = 6, help = 'number of columns on the board')
+    parser.add_argument('--faller-length', type = command_line.positive_int, default = 3, help = 'number of jewels in every faller')
+    parser.add_argument('--colors', type = _parse_colors, default = _DEFAULT_COLORS, help = 'letters of the jewel colors fallers are drawn from')
+    parser.add_argument('--max-fallers', type = command_line.positive_int, default = 10000, help = 'end a game after this many fallers')
+    parser.add_argument('--shard-size', type = command_line.positive_int, default = 1000, help = 'number of games a worker plays per task')
+    parser.add_argument('--workers', type = command_line.positive_int, help = 'number of worker processes (one per core by default)')
+    parser.add_argument('--output', metavar = 'DIRECTORY', help = 'write the record of every game to this directory')
+    options = parser.parse_args(arguments)
+
+    try:
+        result = run_tournament(options.games, options.policy, options.first_seed, options.shard_size, options.workers, options.output,
+                                progress = lambda stats, seconds: print(_report(stats, seconds), file = sys.stderr),
+                                rows = options.rows, columns = options.columns, faller_length = options.faller_length,
+                                colors = options.colors, max_fallers = options.max_fallers)
+    except FileExistsError as error:
+        parser.error(str(error))
+    print(_report(result.stats, result.seconds))
+    print('games by deepest chain:', dict(sorted(result.stats.chain_depths.items())))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
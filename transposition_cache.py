@@ -0,0 +1,68 @@
+import collections
+import sys
+
+
+class TranspositionCache:
+    '''
+    A least-recently-used cache of results computed from a board, keyed by the kind of result and
+    the board's Zobrist hash. Entries are evicted, least recently used first, once their approximate
+    total size goes over max_bytes. Hits and misses are counted per kind of result
+    '''
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self._max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._hits = collections.Counter()
+        self._misses = collections.Counter()
+
+    def get(self, kind: str, board_hash: int):
+        'Returns the result of the given kind cached for a board hash, or None if there is none'
+        key = (kind, board_hash)
+        entry = self._entries.get(key)
+        if entry is None:
+            self._misses[kind] += 1
+            return None
+        self._hits[kind] += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, kind: str, board_hash: int, value) -> None:
+        'Caches a result of the given kind for a board hash, evicting the least recently used results if over the size limit'
+        key = (kind, board_hash)
+        size = _approximate_size(value)
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous[1]
+        if size > self._max_bytes:
+            return
+        self._entries[key] = (value, size)
+        self._bytes += size
+        while self._bytes > self._max_bytes:
+            self._bytes -= self._entries.popitem(last = False)[1][1]
+
+    def clear(self) -> None:
+        'Removes every cached result, keeping the hit and miss counts'
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        'Returns the hits and misses per kind of result, and the number and approximate size in bytes of the cached results'
+        return {
+            'hits': dict(self._hits),
+            'misses': dict(self._misses),
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+        }
+
+
+def _approximate_size(value) -> int:
+    '''
+    Returns the approximate size in bytes of a value made of tuples and lists. Strings and small
+    ints are shared across boards, so only the references to them are counted
+    '''
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        for item in value:
+            if isinstance(item, (tuple, list)):
+                size += _approximate_size(item)
+    return size
@@ -0,0 +1,212 @@
+import numpy as np
+import board_array
+import game_mechanics
+
+NOOP = 0
+LEFT = 1
+RIGHT = 2
+ROTATE = 3
+TICK = 4
+
+
+class VectorGameState:
+    '''
+    Holds many Columns boards in one uint8 array of shape (boards, columns, rows) and steps them in lockstep.
+
+    Every call to step applies one action per board. A board with a faller moves it left or right,
+    rotates it, or lets time pass (falling one row, landing, or freezing). A board without a faller
+    removes every match and lets the columns collapse until the board is stable, ends if the game is
+    over, and otherwise spawns a new faller. GameStepper does the same thing for a single GameState,
+    and the two produce identical boards, rewards and done flags when given the same spawn draws
+    '''
+    def __init__(self, boards: int, rows: int = 13, columns: int = 6, faller_length: int = 3, seed: int = None):
+        self._cells = np.zeros((boards, columns, rows + faller_length - 1), dtype = np.uint8)
+        self._faller_length = faller_length
+        self._rng = np.random.default_rng(seed)
+        self._faller_col = np.zeros(boards, dtype = np.intp)
+        self._faller_bottom = np.zeros(boards, dtype = np.intp)
+        self._has_faller = np.zeros(boards, dtype = bool)
+        self._landed = np.zeros(boards, dtype = bool)
+        self._done = np.zeros(boards, dtype = bool)
+
+    def return_cells(self) -> np.ndarray:
+        'Returns the uint8 array holding every game board'
+        return self._cells
+
+    def return_board(self, index: int) -> list[list[str]]:
+        'Returns a list-of-lists copy of one of the game boards'
+        return board_array.decode_board(self._cells[index])
+
+    def done(self) -> np.ndarray:
+        'Returns the done flag of every board'
+        return self._done.copy()
+
+    def step(self, actions, spawn_scores: np.ndarray = None, spawn_jewels: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Applies one action per board and returns the number of cells each board cleared and its done flag.
+        spawn_scores (boards x columns floats) and spawn_jewels (boards x faller length ints from 1 to 7) decide where
+        new fallers appear and what they hold; they are drawn from the seeded generator when omitted
+        '''
+        boards, columns = self._cells.shape[:2]
+        if spawn_scores is None:
+            spawn_scores = self._rng.random((boards, columns))
+        if spawn_jewels is None:
+            spawn_jewels = self._rng.integers(1, len(game_mechanics.JEWEL_COLORS) + 1, (boards, self._faller_length))
+        actions = np.asarray(actions)
+        active = self._has_faller & ~self._done
+        self._move(np.flatnonzero(active & (actions == LEFT)), -1)
+        self._move(np.flatnonzero(active & (actions == RIGHT)), 1)
+        self._rotate(np.flatnonzero(active & (actions == ROTATE)))
+        self._pass_time(np.flatnonzero(active & (actions == TICK)))
+        rewards = np.zeros(boards, dtype = np.int64)
+        idle = np.flatnonzero(~self._has_faller & ~self._done)
+        if len(idle):
+            rewards[idle] = self._settle(idle)
+            self._end_dead_games(idle)
+            self._spawn(idle[~self._done[idle]], spawn_scores, spawn_jewels)
+        return rewards, self._done.copy()
+
+    def _move(self, indexes: np.ndarray, delta: int) -> None:
+        'Moves the fallers of the given boards one column in delta direction where there is room'
+        if not len(indexes):
+            return
+        columns = self._cells.shape[1]
+        cols = self._faller_col[indexes]
+        rows = self._faller_rows(indexes)
+        targets = cols + delta
+        can_move = (targets >= 0) & (targets < columns)
+        clamped = np.clip(targets, 0, columns - 1)
+        can_move &= ~self._cells[indexes[:, None], clamped[:, None], rows].any(axis = 1)
+        moving, moving_rows = indexes[can_move], rows[can_move]
+        jewels = self._cells[moving[:, None], cols[can_move][:, None], moving_rows]
+        self._cells[moving[:, None], cols[can_move][:, None], moving_rows] = board_array.EMPTY
+        self._cells[moving[:, None], targets[can_move][:, None], moving_rows] = jewels
+        self._faller_col[moving] = targets[can_move]
+        self._update_landing(indexes)
+
+    def _rotate(self, indexes: np.ndarray) -> None:
+        'Rotates the fallers of the given boards so the bottom jewel moves to the top'
+        if not len(indexes):
+            return
+        cols = self._faller_col[indexes][:, None]
+        rows = self._faller_rows(indexes)
+        jewels = self._cells[indexes[:, None], cols, rows]
+        self._cells[indexes[:, None], cols, rows] = np.roll(jewels, 1, axis = 1)
+
+    def _pass_time(self, indexes: np.ndarray) -> None:
+        'Freezes landed fallers and drops every other faller of the given boards by one row'
+        if not len(indexes):
+            return
+        landed = indexes[self._landed[indexes]]
+        self._set_faller_state(landed, board_array.FROZEN)
+        self._has_faller[landed] = False
+        self._landed[landed] = False
+        falling = indexes[~self._landed[indexes] & self._has_faller[indexes]]
+        if not len(falling):
+            return
+        cols = self._faller_col[falling][:, None]
+        rows = self._faller_rows(falling)
+        jewels = self._cells[falling[:, None], cols, rows]
+        self._cells[falling[:, None], cols, rows] = board_array.EMPTY
+        self._cells[falling[:, None], cols, rows + 1] = jewels
+        self._faller_bottom[falling] += 1
+        self._update_landing(falling)
+
+    def _settle(self, indexes: np.ndarray) -> np.ndarray:
+        'Removes matches and collapses columns of the given boards until they are stable. Returns the cells cleared per board'
+        cleared = np.zeros(len(indexes), dtype = np.int64)
+        pending = np.arange(len(indexes))
+        while len(pending):
+            cells = self._cells[indexes[pending]]
+            matched = board_array.run_mask(cells)
+            counts = matched.sum(axis = (1, 2))
+            has_match = counts > 0
+            if not has_match.any():
+                break
+            cleared[pending] += counts
+            cells[matched] = board_array.EMPTY
+            pending = pending[has_match]
+            self._cells[indexes[pending]] = board_array.compact_columns(cells[has_match])
+        return cleared
+
+    def _end_dead_games(self, indexes: np.ndarray) -> None:
+        'Marks boards as done when a jewel is frozen in the hidden rows or no column has room for a faller'
+        cells = self._cells[indexes]
+        hidden_rows = self._faller_length - 1
+        dead = cells[:, :, :hidden_rows].any(axis = (1, 2)) | cells[:, :, hidden_rows:].all(axis = 2).all(axis = 1)
+        self._done[indexes[dead]] = True
+
+    def _spawn(self, indexes: np.ndarray, spawn_scores: np.ndarray, spawn_jewels: np.ndarray) -> None:
+        'Places a new faller in the highest-scoring non-full column of each of the given boards'
+        if not len(indexes):
+            return
+        full = self._cells[indexes, :, self._faller_length - 1:].all(axis = 2)
+        cols = np.where(full, -1.0, spawn_scores[indexes]).argmax(axis = 1)
+        jewels = board_array.with_state(np.asarray(spawn_jewels, dtype = np.uint8)[indexes], board_array.FALLING)
+        self._cells[indexes[:, None], cols[:, None], np.arange(self._faller_length)] = jewels
+        self._faller_col[indexes] = cols
+        self._faller_bottom[indexes] = self._faller_length
+        self._has_faller[indexes] = True
+        self._landed[indexes] = False
+        self._update_landing(indexes)
+
+    def _update_landing(self, indexes: np.ndarray) -> None:
+        'Lands the fallers of the given boards that rest on a jewel or the floor, and unlands the rest'
+        rows = self._cells.shape[2]
+        bottoms = self._faller_bottom[indexes]
+        below = self._cells[indexes, self._faller_col[indexes], np.minimum(bottoms, rows - 1)]
+        landed = (bottoms == rows) | (below != board_array.EMPTY)
+        self._landed[indexes] = landed
+        self._set_faller_state(indexes[landed], board_array.LANDED)
+        self._set_faller_state(indexes[~landed], board_array.FALLING)
+
+    def _set_faller_state(self, indexes: np.ndarray, state: int) -> None:
+        'Changes the state of the faller jewels of the given boards'
+        cols = self._faller_col[indexes][:, None]
+        rows = self._faller_rows(indexes)
+        self._cells[indexes[:, None], cols, rows] = board_array.with_state(self._cells[indexes[:, None], cols, rows], state)
+
+    def _faller_rows(self, indexes: np.ndarray) -> np.ndarray:
+        'Returns the rows covered by the fallers of the given boards, one row of indexes per board'
+        return self._faller_bottom[indexes][:, None] + np.arange(-self._faller_length, 0)
+
+
+class GameStepper:
+    '''
+    Steps a single GameState with the same rules as VectorGameState, so a batch of boards can be
+    checked against the scalar game engine
+    '''
+    def __init__(self, game_state: game_mechanics.GameState):
+        self._game_state = game_state
+        self._done = False
+
+    def return_game_state(self) -> game_mechanics.GameState:
+        'Returns the GameState being stepped'
+        return self._game_state
+
+    def step(self, action: int, spawn_scores, spawn_jewels) -> tuple[int, bool]:
+        'Applies one action and returns the number of cells cleared and whether the game is over'
+        if self._done:
+            return 0, True
+        game_state = self._game_state
+        if not game_state.faller_in_frozen():
+            if action == LEFT:
+                game_state.faller_move_delta(-1)
+            elif action == RIGHT:
+                game_state.faller_move_delta(1)
+            elif action == ROTATE:
+                game_state.faller_reverse()
+            elif action == TICK:
+                game_state.faller_pass_time()
+        reward = 0
+        if game_state.faller_in_frozen():
+            for step in game_state.resolve_cascades():
+                reward += step.cleared
+            non_full = game_state.free_columns()
+            if game_state.check_if_dead() or not non_full:
+                self._done = True
+            else:
+                column = max(non_full, key = lambda col: spawn_scores[col])
+                jewels = ['[' + game_mechanics.JEWEL_COLORS[jewel - 1] + ']' for jewel in spawn_jewels]
+                game_state.put_faller_in_board((column, jewels))
+        return reward, self._done